@@ -1,14 +1,28 @@
-from flask import Flask, jsonify, request
+from flask import Flask, jsonify, request, Response, stream_with_context, g
 import os
-import requests
+import sys
+import importlib
 import logging
 import time
 import inspect # Added for introspection of function parameters
-
-# Imports for Google API
-from google.oauth2.credentials import Credentials as OAuthCredentials
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
+import json
+import hashlib
+import threading
+import queue
+import uuid
+import random
+import re
+import tempfile
+import bisect
+import itertools
+import math
+import atexit
+import contextlib
+import contextvars
+import sqlite3
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
 
 # --- Logging Configuration ---
 logging.basicConfig(
@@ -20,6 +34,44 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
+# --- Deferred Imports for Google API / requests ---
+# requests and the Google client libraries add several hundred ms to a cold start, so they are
+# imported on first use. requests is a deferred module proxy (imported on first attribute access,
+# which also covers `except requests.exceptions...` clauses). importlib.util.LazyLoader is not
+# used because it is not thread-safe before Python 3.12.3 (gh-114763), and the prewarm, watcher,
+# outbox and request threads can all touch requests first. The Google names are bound by
+# _load_google_client_libs() the first time a service is built; until then HttpError is a
+# placeholder, which is safe because no Google API call can have raised before that point.
+class _DeferredModule:
+    """Stands in for a module until its first attribute access, then imports it (the import system serializes concurrent imports)."""
+    def __init__(self, module_name):
+        self._module_name = module_name
+        self._module = None
+
+    def __getattr__(self, attribute):
+        if self._module is None:
+            self._module = importlib.import_module(self._module_name)
+        return getattr(self._module, attribute)
+
+requests = _DeferredModule("requests")
+
+class HttpError(Exception):
+    """Placeholder, replaced by googleapiclient.errors.HttpError once the client library is loaded."""
+
+OAuthCredentials = None
+build_from_document = None
+
+def _load_google_client_libs():
+    global OAuthCredentials, HttpError, build_from_document
+    if build_from_document is not None: return
+    start_time = time.time()
+    from google.oauth2.credentials import Credentials as _OAuthCredentials
+    from googleapiclient.errors import HttpError as _HttpError
+    from googleapiclient.discovery import build_from_document as _build_from_document
+    OAuthCredentials, HttpError = _OAuthCredentials, _HttpError
+    build_from_document = _build_from_document # Bound last: other threads treat it as the "loaded" flag
+    logger.info(f"Google API client libraries imported in {time.time() - start_time:.2f}s.")
+
 # --- Configuration (Main App) ---
 CLIENT_ID = os.environ.get("GOOGLE_CLIENT_ID_FLASK_APP", "26763482887-coiufpukc1l69aaulaiov5o0u3en2del.apps.googleusercontent.com")
 CLIENT_SECRET = os.environ.get("GOOGLE_CLIENT_SECRET_FLASK_APP", "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") # !!! STORE SECRET SECURELY !!!
@@ -27,6 +79,170 @@ TOKEN_URL = "https://oauth2.googleapis.com/token"
 REDIRECT_URI = os.environ.get("GOOGLE_REDIRECT_URI_FLASK_APP", "https://serverless.on-demand.io/apps/googlesheets/auth/callback")
 REQUEST_TIMEOUT_SECONDS = 30
 
+# --- Startup-Optimized Mode (serverless cold starts) ---
+# FAST_COLD_START=1 loads the /sheets/op/* route table and the Sheets discovery document from a
+# precomputed artifact (build it with `python GSheetsAPI.py --build-startup-artifact`) instead of
+# introspecting the builder functions and registering ~40 URL rules at import time.
+FAST_COLD_START = os.environ.get("FAST_COLD_START", "false").lower() in ("1", "true", "yes")
+STARTUP_ARTIFACT_DIR = os.environ.get("STARTUP_ARTIFACT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "startup_artifact"))
+STARTUP_ARTIFACT_ROUTES_FILE = "routes.json"
+STARTUP_ARTIFACT_DISCOVERY_FILE = "sheets_v4_discovery.json"
+PREWARM_SPECIFIC_USER_TOKEN = os.environ.get("PREWARM_SPECIFIC_USER_TOKEN", "false").lower() in ("1", "true", "yes")
+
+# --- Tracing (optional, OpenTelemetry-compatible export) ---
+# TRACING_ENABLED=1 records a SERVER span per HTTP request (continuing an incoming W3C
+# `traceparent`) with child spans for admission, token acquisition, service build, each Google
+# API execute(), retries and response serialization. Finished spans are exported in OTLP/JSON,
+# either appended to TRACING_FILE_PATH (one export batch per line) or POSTed to a local
+# collector at TRACING_OTLP_ENDPOINT. When tracing is disabled every hook is a no-op.
+TRACING_ENABLED = os.environ.get("TRACING_ENABLED", "false").lower() in ("1", "true", "yes")
+TRACING_EXPORTER = os.environ.get("TRACING_EXPORTER", "file") # "file" or "otlp"
+TRACING_FILE_PATH = os.environ.get("TRACING_FILE_PATH", "traces.jsonl")
+TRACING_OTLP_ENDPOINT = os.environ.get("TRACING_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+TRACING_SERVICE_NAME = os.environ.get("TRACING_SERVICE_NAME", "gsheets-api")
+TRACING_EXPORT_INTERVAL_SECONDS = 2
+TRACING_MAX_EXPORT_BATCH = 512
+_TRACEPARENT_PATTERN = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+_OTLP_SPAN_KINDS = {"INTERNAL": 1, "SERVER": 2, "CLIENT": 3}
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+_finished_spans = queue.Queue(maxsize=10000)
+_tracing_export_lock = threading.Lock()
+_tracing_exporter_thread = None
+
+def _parse_traceparent(header_value):
+    match = _TRACEPARENT_PATTERN.match((header_value or "").strip().lower())
+    if not match or match.group(1) == "0" * 32 or match.group(2) == "0" * 16: return None
+    return {"trace_id": match.group(1), "span_id": match.group(2), "remote": True}
+
+def start_span(name, kind="INTERNAL", parent=None, **attributes):
+    """Starts a span as a child of `parent` (or the current span) and makes it current. Returns (span, context_token)."""
+    if not TRACING_ENABLED: return None, None
+    parent = parent or _current_span.get()
+    span = {
+        "name": name, "kind": kind, "trace_id": parent["trace_id"] if parent else os.urandom(16).hex(),
+        "span_id": os.urandom(8).hex(), "parent_span_id": parent["span_id"] if parent else None,
+        "start_ns": time.time_ns(), "end_ns": None, "attributes": dict(attributes), "error": None
+    }
+    return span, _current_span.set(span)
+
+def end_span(span, context_token, error=None):
+    if span is None: return
+    span["end_ns"] = time.time_ns()
+    if error is not None: span["error"] = f"{type(error).__name__}: {error}"
+    try:
+        _current_span.reset(context_token)
+    except ValueError: # Ended from a different context (e.g. after a streamed response)
+        _current_span.set(None)
+    try:
+        _finished_spans.put_nowait(span)
+    except queue.Full:
+        logger.warning(f"TRACING: Export queue full; dropped span '{span['name']}'.")
+    _tracing_ensure_exporter()
+
+@contextlib.contextmanager
+def trace_span(name, kind="INTERNAL", **attributes):
+    span, context_token = start_span(name, kind, **attributes)
+    try:
+        yield span
+    except BaseException as e:
+        end_span(span, context_token, e); span = None
+        raise
+    finally:
+        if span is not None: end_span(span, context_token)
+
+def set_span_attributes(span, **attributes):
+    if span is not None: span["attributes"].update(attributes)
+
+def _otlp_attribute(key, value):
+    if isinstance(value, bool): otlp_value = {"boolValue": value}
+    elif isinstance(value, int): otlp_value = {"intValue": str(value)}
+    elif isinstance(value, float): otlp_value = {"doubleValue": value}
+    else: otlp_value = {"stringValue": str(value)}
+    return {"key": key, "value": otlp_value}
+
+def _spans_to_otlp(spans):
+    otlp_spans = []
+    for span in spans:
+        otlp_span = {
+            "traceId": span["trace_id"], "spanId": span["span_id"], "name": span["name"],
+            "kind": _OTLP_SPAN_KINDS.get(span["kind"], 1),
+            "startTimeUnixNano": str(span["start_ns"]), "endTimeUnixNano": str(span["end_ns"]),
+            "attributes": [_otlp_attribute(k, v) for k, v in span["attributes"].items() if v is not None],
+            "status": {"code": 2, "message": span["error"]} if span["error"] else {"code": 1}
+        }
+        if span["parent_span_id"]: otlp_span["parentSpanId"] = span["parent_span_id"]
+        otlp_spans.append(otlp_span)
+    return {"resourceSpans": [{
+        "resource": {"attributes": [_otlp_attribute("service.name", TRACING_SERVICE_NAME)]},
+        "scopeSpans": [{"scope": {"name": "GSheetsAPI"}, "spans": otlp_spans}]
+    }]}
+
+def tracing_flush():
+    """Exports every finished span that is still queued. Also runs at interpreter exit."""
+    spans = []
+    while len(spans) < TRACING_MAX_EXPORT_BATCH or not _finished_spans.empty():
+        try: spans.append(_finished_spans.get_nowait())
+        except queue.Empty: break
+        if len(spans) >= TRACING_MAX_EXPORT_BATCH:
+            _tracing_export(spans); spans = []
+    if spans: _tracing_export(spans)
+
+def _tracing_export(spans):
+    payload = _spans_to_otlp(spans)
+    try:
+        with _tracing_export_lock:
+            if TRACING_EXPORTER == "otlp":
+                requests.post(TRACING_OTLP_ENDPOINT, json=payload, timeout=5).raise_for_status()
+            else:
+                with open(TRACING_FILE_PATH, 'a', encoding='utf-8') as f: f.write(json.dumps(payload, separators=(',', ':')) + "\n")
+    except Exception as e:
+        logger.warning(f"TRACING: Failed to export {len(spans)} span(s) via '{TRACING_EXPORTER}': {str(e)}")
+
+def _tracing_export_loop():
+    while True:
+        spans = [_finished_spans.get()]
+        deadline = time.time() + TRACING_EXPORT_INTERVAL_SECONDS
+        while len(spans) < TRACING_MAX_EXPORT_BATCH and time.time() < deadline:
+            try: spans.append(_finished_spans.get(timeout=max(0.0, deadline - time.time())))
+            except queue.Empty: break
+        _tracing_export(spans)
+
+def _tracing_ensure_exporter():
+    global _tracing_exporter_thread
+    if _tracing_exporter_thread is not None: return
+    with _tracing_export_lock:
+        if _tracing_exporter_thread is None:
+            _tracing_exporter_thread = threading.Thread(target=_tracing_export_loop, name="trace-exporter", daemon=True)
+            _tracing_exporter_thread.start()
+            atexit.register(tracing_flush)
+
+def _traced_execute(api_request, operation, spreadsheet_id, **attributes):
+    """Runs api_request.execute() inside a CLIENT span carrying payload sizes and row counts."""
+    if not TRACING_ENABLED: return api_request.execute()
+    request_body = getattr(api_request, "body", None)
+    with trace_span(f"sheets.{operation}", kind="CLIENT", **{
+        "rpc.service": "sheets.v4", "rpc.method": operation, "sheets.spreadsheet_id": spreadsheet_id,
+        "http.request_content_length": len(request_body) if request_body else 0, **attributes
+    }) as span:
+        response_size = {}
+        original_postproc = api_request.postproc
+        def postproc(resp, content):
+            # The raw body is already in memory here; measuring it avoids re-serializing the parsed result.
+            response_size["bytes"] = len(content) if content else 0
+            return original_postproc(resp, content)
+        api_request.postproc = postproc
+        result = api_request.execute()
+        response_attributes = {"http.response_content_length": response_size.get("bytes", 0)}
+        if "values" in result: response_attributes["sheets.response_rows"] = len(result["values"])
+        if "valueRanges" in result: response_attributes["sheets.response_rows"] = sum(len(vr.get("values", [])) for vr in result["valueRanges"])
+        if "replies" in result: response_attributes["sheets.replies"] = len(result["replies"])
+        updates = result.get("updates", result)
+        if "updatedRows" in updates: response_attributes["sheets.updated_rows"] = updates["updatedRows"]
+        if "totalUpdatedRows" in updates: response_attributes["sheets.updated_rows"] = updates["totalUpdatedRows"]
+        set_span_attributes(span, **response_attributes)
+        return result
+
 # --- OAuth and Token Helper Functions (Main App) ---
 def exchange_code_for_tokens(authorization_code):
     logger.info(f"Attempting to exchange authorization code for tokens. Code starts with: {authorization_code[:10]}...")
@@ -88,14 +304,56 @@ def get_access_token(refresh_token):
     except Exception as e:
         duration = time.time() - start_time; logger.error(f"Generic exception during token refresh after {duration:.2f} seconds: {str(e)}", exc_info=True); raise
 
+def _refresh_token_hash(refresh_token):
+    # Stable, non-reversible key for grouping state per credential without keeping the raw token as a key.
+    return hashlib.sha256(refresh_token.encode('utf-8')).hexdigest()[:16]
+
+_sheets_discovery_document = None
+_discovery_document_lock = threading.Lock()
+
+def _prepare_discovery_document(discovery_document):
+    # googleapiclient fixes up method descriptions in place the first time each method object is
+    # generated. Generating every resource once makes a shared document effectively read-only,
+    # so concurrent requests can build services from the same dict. This is slow (docstring
+    # generation), which is why it is done when writing the startup artifact, not at runtime.
+    def visit(resource, resource_desc):
+        for name, sub_desc in resource_desc.get("resources", {}).items():
+            visit(getattr(resource, name)(), sub_desc)
+    visit(build_from_document(discovery_document, credentials=OAuthCredentials(token="discovery-prepare")), discovery_document)
+    return discovery_document
+
+def _get_sheets_discovery_document():
+    """
+    Loads the Sheets v4 discovery document once per process. With FAST_COLD_START this is the prepared
+    dict from the startup artifact (no per-build parsing); otherwise it is the JSON text of the
+    googleapiclient static document, parsed by each build as build() did before.
+    """
+    global _sheets_discovery_document
+    if _sheets_discovery_document is not None: return _sheets_discovery_document
+    with _discovery_document_lock:
+        if _sheets_discovery_document is None:
+            start_time = time.time()
+            artifact_path = os.path.join(STARTUP_ARTIFACT_DIR, STARTUP_ARTIFACT_DISCOVERY_FILE)
+            if FAST_COLD_START and os.path.exists(artifact_path):
+                with open(artifact_path, encoding='utf-8') as f: discovery_document = json.load(f)
+                source = artifact_path
+            else:
+                from googleapiclient.discovery_cache import get_static_doc
+                discovery_document = get_static_doc("sheets", "v4")
+                source = "googleapiclient static discovery cache"
+            _sheets_discovery_document = discovery_document
+            logger.info(f"Sheets discovery document loaded from {source} in {time.time() - start_time:.2f}s.")
+    return _sheets_discovery_document
+
 def get_sheets_service(access_token):
     logger.info("Building Google Sheets API service object...")
     if not access_token:
         logger.error("Cannot build sheets service: access_token is missing.")
         raise ValueError("Access token is required to build sheets service.")
     try:
+        _load_google_client_libs()
         creds = OAuthCredentials(token=access_token)
-        service = build("sheets", "v4", credentials=creds, cache_discovery=False)
+        service = build_from_document(_get_sheets_discovery_document(), credentials=creds)
         logger.info("Google Sheets API service object built successfully.")
         return service
     except Exception as e:
@@ -111,20 +369,190 @@ def api_batch_update(service, spreadsheet_id, requests_list):
     start_time = time.time()
     try:
         body = {"requests": requests_list}
-        result = service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id, body=body).execute()
+        result = _traced_execute(service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id, body=body), "batchUpdate", spreadsheet_id, **{"sheets.request_count": len(requests_list)})
         duration = time.time() - start_time; logger.info(f"API: Batch update successful in {duration:.2f}s."); logger.debug(f"API: Batch update result: {result}"); return result
     except HttpError as e: duration = time.time() - start_time; error_content = e.content.decode('utf-8') if e.content else str(e); logger.error(f"API: HttpError during batchUpdate after {duration:.2f}s: {error_content}", exc_info=True); raise
     except Exception as e: duration = time.time() - start_time; logger.error(f"API: Generic error during batchUpdate after {duration:.2f}s: {str(e)}", exc_info=True); raise
 
+# --- batchUpdate Request-List Optimizer ---
+# Only repeatCell and updateBorders are rewritten. Both are blind writes, so within a run of
+# them an operation fully overridden by a later one can be dropped, and a compatible operation
+# can be folded into an earlier one as long as nothing in between touches its range. Every
+# other request kind (insertDimension, deleteDimension, sortRange, cutPaste, ...) is a barrier:
+# it stays in place and nothing is moved or merged across it.
+BATCH_UPDATE_MAX_PAYLOAD_BYTES = int(os.environ.get("BATCH_UPDATE_MAX_PAYLOAD_BYTES", str(9 * 1024 * 1024))) # API limit is 10 MB per request body
+BATCH_UPDATE_OPTIMIZER_WINDOW = int(os.environ.get("BATCH_UPDATE_OPTIMIZER_WINDOW", "32")) # Kept requests each incoming request is compared with
+_OPTIMIZABLE_REQUEST_KINDS = ("repeatCell", "updateBorders")
+_BORDER_SIDES = ("top", "bottom", "left", "right", "innerHorizontal", "innerVertical")
+_RANGE_AXES = (("startRowIndex", "endRowIndex"), ("startColumnIndex", "endColumnIndex"))
+
+def _optimizable_kind(req):
+    if not isinstance(req, dict) or len(req) != 1: return None
+    kind = next(iter(req))
+    if kind in _OPTIMIZABLE_REQUEST_KINDS and isinstance(req[kind], dict) and isinstance(req[kind].get("range"), dict):
+        return kind
+    return None
+
+def _range_axis(range_dict, axis):
+    start_key, end_key = _RANGE_AXES[axis]
+    return range_dict.get(start_key) or 0, range_dict.get(end_key) # end None = unbounded
+
+def _range_covers(outer, inner):
+    if outer.get("sheetId", 0) != inner.get("sheetId", 0): return False
+    for axis in (0, 1):
+        outer_start, outer_end = _range_axis(outer, axis); inner_start, inner_end = _range_axis(inner, axis)
+        if inner_start < outer_start: return False
+        if outer_end is not None and (inner_end is None or inner_end > outer_end): return False
+    return True
+
+def _ranges_intersect(a, b):
+    if a.get("sheetId", 0) != b.get("sheetId", 0): return False
+    for axis in (0, 1):
+        a_start, a_end = _range_axis(a, axis); b_start, b_end = _range_axis(b, axis)
+        if (a_end is not None and a_end <= b_start) or (b_end is not None and b_end <= a_start): return False
+    return True
+
+def _fields_cover(later_fields, earlier_fields):
+    later = {f.strip() for f in later_fields.split(",")}
+    if "*" in later: return True
+    for field in (f.strip() for f in earlier_fields.split(",")):
+        if field == "*" or not any(field == l or field.startswith(l + ".") for l in later): return False
+    return True
+
+def _request_overrides(later_req, earlier_req):
+    kind = _optimizable_kind(later_req)
+    if kind is None or kind != _optimizable_kind(earlier_req): return False
+    later, earlier = later_req[kind], earlier_req[kind]
+    if kind == "repeatCell":
+        return _range_covers(later["range"], earlier["range"]) and _fields_cover(later.get("fields", ""), earlier.get("fields", ""))
+    # Outer borders depend on the range geometry, so only an identical range can override.
+    return later["range"] == earlier["range"] and all(side in later for side in _BORDER_SIDES if side in earlier)
+
+def _merged_range(earlier_req, later_req):
+    """Returns the union range if the two requests can be expressed as one request, else None."""
+    kind = _optimizable_kind(later_req)
+    if kind is None or kind != _optimizable_kind(earlier_req): return None
+    earlier, later = earlier_req[kind], later_req[kind]
+    a, b = earlier["range"], later["range"]
+    if a.get("sheetId", 0) != b.get("sheetId", 0): return None
+    if kind == "repeatCell":
+        if earlier.get("cell") != later.get("cell") or earlier.get("fields") != later.get("fields"): return None
+    elif any(earlier.get(side) != later.get(side) for side in _BORDER_SIDES):
+        return None
+    for axis in (0, 1):
+        other_axis = 1 - axis
+        if _range_axis(a, other_axis) != _range_axis(b, other_axis): continue
+        if kind == "updateBorders":
+            # Stacking along an axis turns the seam into an inner border: only equivalent if those sides agree.
+            seam_sides = ("top", "bottom", "innerHorizontal") if axis == 0 else ("left", "right", "innerVertical")
+            if not (later.get(seam_sides[0]) == later.get(seam_sides[1]) == later.get(seam_sides[2])): return None
+        a_start, a_end = _range_axis(a, axis); b_start, b_end = _range_axis(b, axis)
+        if (a_end is not None and a_end < b_start) or (b_end is not None and b_end < a_start): return None # Gap between them
+        start_key, end_key = _RANGE_AXES[axis]
+        merged = dict(a)
+        merged[start_key] = min(a_start, b_start)
+        if a_end is None or b_end is None: merged.pop(end_key, None)
+        else: merged[end_key] = max(a_end, b_end)
+        return merged
+    return None
+
+def _range_box(kind, op, range_dict):
+    """
+    (kind, sheetId, row start, row end, column start, column end, payload key) with unbounded ends as inf.
+    Used for cheap pre-checks; two requests can only merge if their payload keys (everything but the range) match.
+    """
+    (row_start, row_end), (col_start, col_end) = _range_axis(range_dict, 0), _range_axis(range_dict, 1)
+    payload_key = json.dumps({k: v for k, v in op.items() if k != "range"}, sort_keys=True, separators=(',', ':'))
+    return (kind, range_dict.get("sheetId", 0), row_start, math.inf if row_end is None else row_end, col_start, math.inf if col_end is None else col_end, payload_key)
+
+def _boxes_intersect(a, b):
+    return a[1] == b[1] and a[2] < b[3] and b[2] < a[3] and a[4] < b[5] and b[4] < a[5]
+
+def _box_may_override(later, earlier):
+    return later[0] == earlier[0] and later[1] == earlier[1] and later[2] <= earlier[2] and earlier[3] <= later[3] and later[4] <= earlier[4] and earlier[5] <= later[5]
+
+def _box_may_merge(a, b):
+    return a[6] == b[6] and a[0] == b[0] and a[1] == b[1] and (a[2:4] == b[2:4] or a[4:6] == b[4:6])
+
+def _optimize_segment(segment, report):
+    # A request is only compared with the last BATCH_UPDATE_OPTIMIZER_WINDOW kept requests, which keeps the
+    # pass linear in the list length. Anything further back is left where it is: appending is always safe.
+    out, boxes = [], []
+    for req in segment:
+        kind = _optimizable_kind(req)
+        box = _range_box(kind, req[kind], req[kind]["range"])
+        merge_index = None # None: still searching, -1: blocked by an intersecting op
+        for i in range(len(out) - 1, max(0, len(out) - BATCH_UPDATE_OPTIMIZER_WINDOW) - 1, -1):
+            if _box_may_override(box, boxes[i]) and _request_overrides(req, out[i]):
+                del out[i]; del boxes[i]
+                report["removed_overridden"] += 1
+                if merge_index is not None and merge_index > i: merge_index -= 1
+                continue
+            if merge_index is None:
+                if _box_may_merge(boxes[i], box) and _merged_range(out[i], req) is not None: merge_index = i
+                elif _boxes_intersect(boxes[i], box): merge_index = -1 # Cannot move this request back past an op touching the same cells
+        if merge_index is not None and merge_index >= 0:
+            merged_range = _merged_range(out[merge_index], req)
+            out[merge_index] = {kind: dict(out[merge_index][kind], range=merged_range)}
+            boxes[merge_index] = _range_box(kind, out[merge_index][kind], merged_range)
+            report["merged"] += 1
+        else:
+            out.append(req); boxes.append(box)
+    return out
+
+def _split_into_batches(requests_list, max_payload_bytes):
+    # Sizes as the client library sends them: json.dumps with the default separators.
+    envelope_size = len(json.dumps({"requests": []}))
+    batches, current, current_size = [], [], envelope_size
+    for req in requests_list:
+        req_size = len(json.dumps(req)) + 2
+        if current and current_size + req_size > max_payload_bytes:
+            batches.append(current); current, current_size = [], envelope_size
+        if req_size + envelope_size > max_payload_bytes:
+            logger.warning(f"API: Single batchUpdate request of {req_size} bytes exceeds the {max_payload_bytes} byte payload limit; sending it alone.")
+        current.append(req); current_size += req_size
+    if current: batches.append(current)
+    return batches
+
+def optimize_batch_update_requests(requests_list, max_payload_bytes=BATCH_UPDATE_MAX_PAYLOAD_BYTES):
+    """
+    Removes redundant repeatCell/updateBorders requests, merges adjacent or overlapping compatible
+    ones and splits the result into batches that stay under max_payload_bytes.
+    :return: (list of request batches, report dict with before/after counts)
+    """
+    if isinstance(max_payload_bytes, bool) or not isinstance(max_payload_bytes, int) or max_payload_bytes <= 0:
+        raise ValueError(f"max_payload_bytes must be a positive integer, got {max_payload_bytes!r}.")
+    start_time = time.time()
+    report = {"requests_before": len(requests_list), "removed_overridden": 0, "merged": 0}
+    optimized, segment = [], []
+    for req in requests_list:
+        if _optimizable_kind(req):
+            segment.append(req)
+            continue
+        optimized.extend(_optimize_segment(segment, report)); segment = []
+        optimized.append(req) # Barrier: order-dependent or unmodelled request, kept as is
+    optimized.extend(_optimize_segment(segment, report))
+    batches = _split_into_batches(optimized, max_payload_bytes)
+    report.update({"requests_after": len(optimized), "batches": len(batches), "optimize_ms": round((time.time() - start_time) * 1000, 2)})
+    logger.info(f"API: batchUpdate optimizer: {report}")
+    return batches, report
+
+def api_batch_update_optimized(service, spreadsheet_id, requests_list, max_payload_bytes=BATCH_UPDATE_MAX_PAYLOAD_BYTES):
+    # Note: when the list is split, batches are applied one after another and are not atomic as a whole,
+    # and reply indexes refer to the optimized requests, not the original list.
+    batches, report = optimize_batch_update_requests(requests_list, max_payload_bytes)
+    results = [api_batch_update(service, spreadsheet_id, batch) for batch in batches]
+    return {"batch_results": results, "optimizer_report": report}
+
 # --- Google Sheets values.* API Wrapper Functions ---
 def api_get_values(service, spreadsheet_id, range_name, major_dimension="ROWS", value_render_option="FORMATTED_VALUE", date_time_render_option="SERIAL_NUMBER"):
     logger.info(f"API: Getting values from sheet '{spreadsheet_id}', range '{range_name}'.")
     start_time = time.time()
     try:
-        result = service.spreadsheets().values().get(
+        result = _traced_execute(service.spreadsheets().values().get(
             spreadsheetId=spreadsheet_id, range=range_name, majorDimension=major_dimension,
             valueRenderOption=value_render_option, dateTimeRenderOption=date_time_render_option
-        ).execute()
+        ), "values.get", spreadsheet_id)
         duration = time.time() - start_time; logger.info(f"API: Get values successful in {duration:.2f}s."); return result
     except HttpError as e: duration = time.time() - start_time; error_content = e.content.decode('utf-8') if e.content else str(e); logger.error(f"API: HttpError getting values after {duration:.2f}s: {error_content}", exc_info=True); raise
     except Exception as e: duration = time.time() - start_time; logger.error(f"API: Generic error getting values after {duration:.2f}s: {str(e)}", exc_info=True); raise
@@ -133,10 +561,10 @@ def api_batch_get_values(service, spreadsheet_id, ranges_list, major_dimension="
     logger.info(f"API: Batch getting values from sheet '{spreadsheet_id}', ranges: {ranges_list}.")
     start_time = time.time()
     try:
-        result = service.spreadsheets().values().batchGet(
+        result = _traced_execute(service.spreadsheets().values().batchGet(
             spreadsheetId=spreadsheet_id, ranges=ranges_list, majorDimension=major_dimension,
             valueRenderOption=value_render_option, dateTimeRenderOption=date_time_render_option
-        ).execute()
+        ), "values.batchGet", spreadsheet_id, **{"sheets.range_count": len(ranges_list)})
         duration = time.time() - start_time; logger.info(f"API: Batch get values successful in {duration:.2f}s."); return result
     except HttpError as e: duration = time.time() - start_time; error_content = e.content.decode('utf-8') if e.content else str(e); logger.error(f"API: HttpError batch getting values after {duration:.2f}s: {error_content}", exc_info=True); raise
     except Exception as e: duration = time.time() - start_time; logger.error(f"API: Generic error batch getting values after {duration:.2f}s: {str(e)}", exc_info=True); raise
@@ -146,9 +574,9 @@ def api_update_values(service, spreadsheet_id, range_name, values_data, value_in
     start_time = time.time()
     try:
         body = {"values": values_data} # values_data should be list of lists
-        result = service.spreadsheets().values().update(
+        result = _traced_execute(service.spreadsheets().values().update(
             spreadsheetId=spreadsheet_id, range=range_name, valueInputOption=value_input_option, body=body
-        ).execute()
+        ), "values.update", spreadsheet_id, **{"sheets.request_rows": len(values_data)})
         duration = time.time() - start_time; logger.info(f"API: Update values successful in {duration:.2f}s. Result: {result}"); return result
     except HttpError as e: duration = time.time() - start_time; error_content = e.content.decode('utf-8') if e.content else str(e); logger.error(f"API: HttpError updating values after {duration:.2f}s: {error_content}", exc_info=True); raise
     except Exception as e: duration = time.time() - start_time; logger.error(f"API: Generic error updating values after {duration:.2f}s: {str(e)}", exc_info=True); raise
@@ -159,7 +587,7 @@ def api_batch_update_values(service, spreadsheet_id, data_list, value_input_opti
     start_time = time.time()
     try:
         body = {"valueInputOption": value_input_option, "data": data_list}
-        result = service.spreadsheets().values().batchUpdate(spreadsheetId=spreadsheet_id, body=body).execute()
+        result = _traced_execute(service.spreadsheets().values().batchUpdate(spreadsheetId=spreadsheet_id, body=body), "values.batchUpdate", spreadsheet_id, **{"sheets.request_rows": sum(len(vr.get("values", [])) for vr in data_list)})
         duration = time.time() - start_time; logger.info(f"API: Batch update values successful in {duration:.2f}s."); return result
     except HttpError as e: duration = time.time() - start_time; error_content = e.content.decode('utf-8') if e.content else str(e); logger.error(f"API: HttpError batch updating values after {duration:.2f}s: {error_content}", exc_info=True); raise
     except Exception as e: duration = time.time() - start_time; logger.error(f"API: Generic error batch updating values after {duration:.2f}s: {str(e)}", exc_info=True); raise
@@ -176,7 +604,7 @@ def api_batch_update_values_by_data_filter(service, spreadsheet_id, data_filter_
             "responseValueRenderOption": response_value_render_option,
             "responseDateTimeRenderOption": response_date_time_render_option
         }
-        result = service.spreadsheets().values().batchUpdateByDataFilter(spreadsheetId=spreadsheet_id, body=body).execute()
+        result = _traced_execute(service.spreadsheets().values().batchUpdateByDataFilter(spreadsheetId=spreadsheet_id, body=body), "values.batchUpdateByDataFilter", spreadsheet_id)
         duration = time.time() - start_time; logger.info(f"API: Batch update values by data filter successful in {duration:.2f}s."); return result
     except HttpError as e: duration = time.time() - start_time; error_content = e.content.decode('utf-8') if e.content else str(e); logger.error(f"API: HttpError batch updating by data filter after {duration:.2f}s: {error_content}", exc_info=True); raise
     except Exception as e: duration = time.time() - start_time; logger.error(f"API: Generic error batch updating by data filter after {duration:.2f}s: {str(e)}", exc_info=True); raise
@@ -186,13 +614,13 @@ def api_append_values(service, spreadsheet_id, range_name, values_data, value_in
     start_time = time.time()
     try:
         body = {"values": values_data}
-        result = service.spreadsheets().values().append(
+        result = _traced_execute(service.spreadsheets().values().append(
             spreadsheetId=spreadsheet_id, range=range_name, valueInputOption=value_input_option,
             insertDataOption=insert_data_option, body=body,
             includeValuesInResponse=include_values_in_response,
             responseValueRenderOption=response_value_render_option,
             responseDateTimeRenderOption=response_date_time_render_option
-        ).execute()
+        ), "values.append", spreadsheet_id, **{"sheets.request_rows": len(values_data)})
         duration = time.time() - start_time; logger.info(f"API: Value append successful in {duration:.2f}s. Updates: {result.get('updates')}"); return result
     except HttpError as e: duration = time.time() - start_time; error_content = e.content.decode('utf-8') if e.content else str(e); logger.error(f"API: HttpError appending values after {duration:.2f}s: {error_content}", exc_info=True); raise
     except Exception as e: duration = time.time() - start_time; logger.error(f"API: Generic error appending values after {duration:.2f}s: {str(e)}", exc_info=True); raise
@@ -201,7 +629,7 @@ def api_clear_values(service, spreadsheet_id, range_name):
     logger.info(f"API: Clearing values from sheet '{spreadsheet_id}', range '{range_name}'.")
     start_time = time.time()
     try:
-        result = service.spreadsheets().values().clear(spreadsheetId=spreadsheet_id, range=range_name, body={}).execute()
+        result = _traced_execute(service.spreadsheets().values().clear(spreadsheetId=spreadsheet_id, range=range_name, body={}), "values.clear", spreadsheet_id)
         duration = time.time() - start_time; logger.info(f"API: Values clear successful in {duration:.2f}s. Cleared range: {result.get('clearedRange')}"); return result
     except HttpError as e: duration = time.time() - start_time; error_content = e.content.decode('utf-8') if e.content else str(e); logger.error(f"API: HttpError clearing values after {duration:.2f}s: {error_content}", exc_info=True); raise
     except Exception as e: duration = time.time() - start_time; logger.error(f"API: Generic error clearing values after {duration:.2f}s: {str(e)}", exc_info=True); raise
@@ -212,7 +640,7 @@ def api_batch_clear_values(service, spreadsheet_id, ranges_list):
     start_time = time.time()
     try:
         body = {"ranges": ranges_list}
-        result = service.spreadsheets().values().batchClear(spreadsheetId=spreadsheet_id, body=body).execute()
+        result = _traced_execute(service.spreadsheets().values().batchClear(spreadsheetId=spreadsheet_id, body=body), "values.batchClear", spreadsheet_id)
         duration = time.time() - start_time; logger.info(f"API: Batch clear values successful in {duration:.2f}s."); return result
     except HttpError as e: duration = time.time() - start_time; error_content = e.content.decode('utf-8') if e.content else str(e); logger.error(f"API: HttpError batch clearing values after {duration:.2f}s: {error_content}", exc_info=True); raise
     except Exception as e: duration = time.time() - start_time; logger.error(f"API: Generic error batch clearing values after {duration:.2f}s: {str(e)}", exc_info=True); raise
@@ -223,7 +651,7 @@ def api_batch_clear_values_by_data_filter(service, spreadsheet_id, data_filters_
     start_time = time.time()
     try:
         body = {"dataFilters": data_filters_list}
-        result = service.spreadsheets().values().batchClearByDataFilter(spreadsheetId=spreadsheet_id, body=body).execute()
+        result = _traced_execute(service.spreadsheets().values().batchClearByDataFilter(spreadsheetId=spreadsheet_id, body=body), "values.batchClearByDataFilter", spreadsheet_id)
         duration = time.time() - start_time; logger.info(f"API: Batch clear values by data filter successful in {duration:.2f}s."); return result
     except HttpError as e: duration = time.time() - start_time; error_content = e.content.decode('utf-8') if e.content else str(e); logger.error(f"API: HttpError batch clearing by data filter after {duration:.2f}s: {error_content}", exc_info=True); raise
     except Exception as e: duration = time.time() - start_time; logger.error(f"API: Generic error batch clearing by data filter after {duration:.2f}s: {str(e)}", exc_info=True); raise
@@ -232,11 +660,22 @@ def api_get_spreadsheet_metadata(service, spreadsheet_id, fields="properties,she
     logger.info(f"API: Getting metadata for spreadsheet '{spreadsheet_id}' with fields '{fields}', includeGridData: {include_grid_data}.")
     start_time = time.time()
     try:
-        result = service.spreadsheets().get(spreadsheetId=spreadsheet_id, fields=fields, includeGridData=include_grid_data).execute()
+        result = _traced_execute(service.spreadsheets().get(spreadsheetId=spreadsheet_id, fields=fields, includeGridData=include_grid_data), "get", spreadsheet_id)
         duration = time.time() - start_time; logger.info(f"API: Metadata retrieval successful in {duration:.2f}s."); return result
     except HttpError as e: duration = time.time() - start_time; error_content = e.content.decode('utf-8') if e.content else str(e); logger.error(f"API: HttpError getting metadata after {duration:.2f}s: {error_content}", exc_info=True); raise
     except Exception as e: duration = time.time() - start_time; logger.error(f"API: Generic error getting metadata after {duration:.2f}s: {str(e)}", exc_info=True); raise
 
+def api_copy_sheet_to(service, spreadsheet_id, sheet_id, destination_spreadsheet_id):
+    # spreadsheets.sheets.copyTo: copies one sheet into another spreadsheet; returns the new SheetProperties
+    logger.info(f"API: Copying sheet {sheet_id} of spreadsheet '{spreadsheet_id}' to spreadsheet '{destination_spreadsheet_id}'.")
+    start_time = time.time()
+    try:
+        body = {"destinationSpreadsheetId": destination_spreadsheet_id}
+        result = _traced_execute(service.spreadsheets().sheets().copyTo(spreadsheetId=spreadsheet_id, sheetId=sheet_id, body=body), "sheets.copyTo", spreadsheet_id, **{"sheets.destination_spreadsheet_id": destination_spreadsheet_id})
+        duration = time.time() - start_time; logger.info(f"API: Sheet copy successful in {duration:.2f}s. New sheetId: {result.get('sheetId')}"); return result
+    except HttpError as e: duration = time.time() - start_time; error_content = e.content.decode('utf-8') if e.content else str(e); logger.error(f"API: HttpError copying sheet after {duration:.2f}s: {error_content}", exc_info=True); raise
+    except Exception as e: duration = time.time() - start_time; logger.error(f"API: Generic error copying sheet after {duration:.2f}s: {str(e)}", exc_info=True); raise
+
 # --- Request Builder Helper Functions for batchUpdate ---
 def build_repeat_cell_request(range_dict, cell_data_dict, fields_string):
     return {"repeatCell": {"range": range_dict, "cell": cell_data_dict, "fields": fields_string}}
@@ -434,11 +873,142 @@ def build_update_slicer_spec_request(slicer_id, spec_dict, fields_string="*"): #
     return {"updateSlicerSpec": {"slicerId": slicer_id, "spec": spec_dict, "fields": fields_string}}
 
 
+# --- Compact Matrix + Template Encoding for updateCells ---
+# Clients send a plain value matrix plus a small table of CellFormat templates and a
+# per-cell (template_index) or per-column (column_templates) template index, instead of
+# fully expanded RowData/CellData. Formats are emitted as repeatCell requests over
+# uniform rectangular regions; values go in values-only updateCells. Both strategies write
+# exactly the same cells, and updateCells bodies are split by rows so that each request
+# stays under BATCH_UPDATE_MAX_PAYLOAD_BYTES.
+COMPACT_MAX_REPEAT_CELL_REGIONS = int(os.environ.get("COMPACT_MAX_REPEAT_CELL_REGIONS", "500"))
+
+def _compact_cell_value(value):
+    if value is None or value == "": return None
+    if isinstance(value, bool): return {"boolValue": value}
+    if isinstance(value, (int, float)): return {"numberValue": value}
+    if isinstance(value, str) and value.startswith("="): return {"formulaValue": value}
+    return {"stringValue": str(value)}
+
+def _compact_template_regions(row_templates_list):
+    """Covers the template matrix with rectangles of identical template: horizontal runs per row,
+       extended downwards while the next row has the same run. Returns (row0, row1, col0, col1, template)."""
+    regions, open_runs = [], {} # (col0, col1, template) -> start row
+    for row_offset, row_templates in enumerate(row_templates_list):
+        runs, col = [], 0
+        while col < len(row_templates):
+            template = row_templates[col]; run_start = col
+            while col < len(row_templates) and row_templates[col] == template: col += 1
+            if template is not None: runs.append((run_start, col, template))
+        for run in list(open_runs):
+            if run not in runs: regions.append((open_runs.pop(run), row_offset) + run)
+        for run in runs:
+            open_runs.setdefault(run, row_offset)
+    for run, run_start_row in open_runs.items():
+        regions.append((run_start_row, len(row_templates_list)) + run)
+    return regions
+
+def _compact_update_cells_requests(rows, fields, sheet_id, start_row_index, start_column_index):
+    """Emits the rows as one or more updateCells requests, starting a new request before a chunk would exceed the payload limit."""
+    budget = BATCH_UPDATE_MAX_PAYLOAD_BYTES - 1024 # Room for the request envelope and coordinates
+    requests_list, chunk, chunk_start, chunk_bytes = [], [], 0, 0
+    for row_offset, row in enumerate(rows):
+        row_bytes = len(json.dumps(row)) + 2 # The client library serializes bodies with the default separators
+        if chunk and chunk_bytes + row_bytes > budget:
+            requests_list.append(build_update_cells_request(chunk, fields, start_coordinate_dict={"sheetId": sheet_id, "rowIndex": start_row_index + chunk_start, "columnIndex": start_column_index}))
+            chunk, chunk_start, chunk_bytes = [], row_offset, 0
+        chunk.append(row); chunk_bytes += row_bytes
+    if chunk:
+        requests_list.append(build_update_cells_request(chunk, fields, start_coordinate_dict={"sheetId": sheet_id, "rowIndex": start_row_index + chunk_start, "columnIndex": start_column_index}))
+    return requests_list
+
+def _compact_expanded_requests(sheet_id, values, row_templates_list, templates, start_row_index, start_column_index):
+    rows = []
+    for row_values, row_templates in zip(values, row_templates_list):
+        cells = []
+        for value, template in zip(row_values, row_templates):
+            cell = {}
+            cell_value = _compact_cell_value(value)
+            if cell_value is not None: cell["userEnteredValue"] = cell_value
+            cell["userEnteredFormat"] = templates[template]
+            cells.append(cell)
+        rows.append({"values": cells})
+    return _compact_update_cells_requests(rows, "userEnteredValue,userEnteredFormat", sheet_id, start_row_index, start_column_index)
+
+def _compact_region_requests(sheet_id, values, row_templates_list, templates, start_row_index, start_column_index):
+    requests_list = []
+    for row0, row1, col0, col1, template in _compact_template_regions(row_templates_list):
+        range_dict = {
+            "sheetId": sheet_id,
+            "startRowIndex": start_row_index + row0, "endRowIndex": start_row_index + row1,
+            "startColumnIndex": start_column_index + col0, "endColumnIndex": start_column_index + col1
+        }
+        requests_list.append(build_repeat_cell_request(range_dict, {"userEnteredFormat": templates[template]}, "userEnteredFormat"))
+    if values:
+        rows = []
+        for row_values in values:
+            cells = []
+            for value in row_values:
+                cell_value = _compact_cell_value(value)
+                cells.append({"userEnteredValue": cell_value} if cell_value is not None else {})
+            rows.append({"values": cells})
+        requests_list.extend(_compact_update_cells_requests(rows, "userEnteredValue", sheet_id, start_row_index, start_column_index))
+    return requests_list
+
+def build_compact_update_cells_requests(sheet_id, values, templates=None, template_index=None, column_templates=None, start_row_index=0, start_column_index=0):
+    """
+    Expands the compact encoding into batchUpdate requests.
+    :param values: list of rows of plain values (numbers, booleans, strings, "=formulas"); None/"" clears the cell value.
+    :param templates: list of CellFormat dicts (applied as userEnteredFormat).
+    :param template_index: optional per-cell matrix of indexes into templates (None leaves the format untouched).
+    :param column_templates: optional per-column list of indexes into templates (alternative to template_index).
+    :return: (requests_list, strategy) where strategy is "repeatCell_regions", "expanded" or "mixed" (expanded rows plus regions)
+    """
+    if template_index is not None and column_templates is not None:
+        raise ValueError("Use either template_index or column_templates for compact updateCells, not both.")
+    templates = templates or []
+    if column_templates is not None:
+        row_templates_list = [column_templates] * len(values)
+    else:
+        row_templates_list = template_index or []
+    for row_templates in row_templates_list:
+        for t in row_templates:
+            if t is not None and not (isinstance(t, int) and 0 <= t < len(templates)):
+                raise ValueError(f"Template index {t} is out of range for {len(templates)} template(s).")
+
+    if len(_compact_template_regions(row_templates_list)) <= COMPACT_MAX_REPEAT_CELL_REGIONS:
+        return _compact_region_requests(sheet_id, values, row_templates_list, templates, start_row_index, start_column_index), "repeatCell_regions"
+
+    # Fragmented formatting: fully expanded updateCells are smaller than thousands of repeatCells. The expanded
+    # form writes value and format of every cell it covers, so it is only used for rows where every cell has
+    # both a value position and a template; the remaining rows keep the region form.
+    def row_is_expandable(row_offset):
+        return (row_offset < len(values) and row_offset < len(row_templates_list)
+                and len(row_templates_list[row_offset]) == len(values[row_offset]) and None not in row_templates_list[row_offset])
+
+    requests_list, strategies = [], set()
+    for expandable, row_offsets in itertools.groupby(range(max(len(values), len(row_templates_list))), key=row_is_expandable):
+        row_offsets = list(row_offsets)
+        first, last = row_offsets[0], row_offsets[-1] + 1
+        if expandable:
+            requests_list += _compact_expanded_requests(sheet_id, values[first:last], row_templates_list[first:last], templates, start_row_index + first, start_column_index)
+            strategies.add("expanded")
+        else:
+            requests_list += _compact_region_requests(sheet_id, values[first:last], row_templates_list[first:last], templates, start_row_index + first, start_column_index)
+            strategies.add("repeatCell_regions")
+    return requests_list, strategies.pop() if len(strategies) == 1 else "mixed"
+
+
 # --- Specific User Token Function ---
 SPECIFIC_CLIENT_ID = os.environ.get("SPECIFIC_GOOGLE_CLIENT_ID", "26763482887-q9lcln5nmb0setr60gkohdjrt2msl6o5.apps.googleusercontent.com")
 SPECIFIC_REFRESH_TOKEN = os.environ.get("SPECIFIC_GOOGLE_REFRESH_TOKEN", "1//09qu30gV5_1hZCgYIARAAGAkSNwF-L9IrEOR20gZnhzmvcFcU46oN89TXt-Sf7ET2SAUwx7d9wo0E2E2ISkXw4CxCDDNxouGAVo4")
 
+SPECIFIC_TOKEN_EXPIRY_MARGIN_SECONDS = 300
+_specific_user_token_cache = {"access_token": None, "expires_at": 0}
+
 def get_specific_user_access_token():
+    if _specific_user_token_cache["access_token"] and time.time() < _specific_user_token_cache["expires_at"]:
+        logger.info("Using cached access token for the specific pre-configured user.")
+        return _specific_user_token_cache["access_token"]
     logger.info("Attempting to get access token for a specific pre-configured user.")
     if not CLIENT_SECRET: logger.error("CRITICAL: CLIENT_SECRET not configured for token refresh (specific user)."); raise ValueError("CLIENT_SECRET not configured.")
     if not SPECIFIC_CLIENT_ID or not SPECIFIC_REFRESH_TOKEN: logger.error("CRITICAL: Specific client ID or refresh token not configured."); raise ValueError("Specific client ID or refresh token not configured.")
@@ -448,7 +1018,11 @@ def get_specific_user_access_token():
         response = requests.post(TOKEN_URL, data=payload, timeout=REQUEST_TIMEOUT_SECONDS)
         response.raise_for_status()
         token_data = response.json(); access_token = token_data.get("access_token"); duration = time.time() - start_time
-        if access_token: logger.info(f"Successfully obtained access token for specific user in {duration:.2f}s. Expires in: {token_data.get('expires_in')}s"); return access_token
+        if access_token:
+            logger.info(f"Successfully obtained access token for specific user in {duration:.2f}s. Expires in: {token_data.get('expires_in')}s")
+            _specific_user_token_cache["access_token"] = access_token
+            _specific_user_token_cache["expires_at"] = time.time() + int(token_data.get('expires_in') or 0) - SPECIFIC_TOKEN_EXPIRY_MARGIN_SECONDS
+            return access_token
         else: logger.error(f"Specific user token refresh response missing access_token after {duration:.2f}s. Response: {token_data}"); raise ValueError("Access token not found in specific user refresh response.")
     except requests.exceptions.Timeout: duration = time.time() - start_time; logger.error(f"Timeout ({REQUEST_TIMEOUT_SECONDS}s) during specific user token refresh after {duration:.2f} seconds."); raise
     except requests.exceptions.HTTPError as e:
@@ -458,10 +1032,135 @@ def get_specific_user_access_token():
         raise
     except Exception as e: duration = time.time() - start_time; logger.error(f"Generic exception during specific user token refresh after {duration:.2f} seconds: {str(e)}", exc_info=True); raise
 
+def _prewarm_specific_user_token():
+    try:
+        get_specific_user_access_token()
+    except Exception as e:
+        logger.warning(f"Prewarming the specific user access token failed; it will be fetched on first use: {str(e)}")
+
+if PREWARM_SPECIFIC_USER_TOKEN:
+    threading.Thread(target=_prewarm_specific_user_token, name="specific-token-prewarm", daemon=True).start()
+
+# --- Admission Control (per-tenant / per-endpoint concurrency, priority queueing) ---
+# Requests through handle_google_api_request must be admitted before they fetch a token or call
+# Google. A request is admitted when a global slot, a slot for its tenant (refresh-token hash) and
+# a slot for its endpoint are all free. Waiting requests are served interactive reads first, then
+# FIFO; a waiter whose tenant or endpoint is at its cap does not block others behind it. Requests
+# that cannot be admitted before their priority's deadline are shed with 429 + Retry-After.
+# A queued request still occupies a WSGI worker thread, so queueing is bounded too: a request is
+# shed immediately if its tenant or endpoint already has its maximum number of waiters, or if it
+# is a bulk request and bulk work (in flight + queued) already holds every thread except those
+# reserved for interactive reads. Set ADMISSION_WORKER_THREADS to the server's threads per process.
+ADMISSION_CONTROL_ENABLED = os.environ.get("ADMISSION_CONTROL_ENABLED", "false").lower() in ("1", "true", "yes")
+ADMISSION_WORKER_THREADS = int(os.environ.get("ADMISSION_WORKER_THREADS", "8"))
+ADMISSION_RESERVED_INTERACTIVE_THREADS = int(os.environ.get("ADMISSION_RESERVED_INTERACTIVE_THREADS", "2"))
+ADMISSION_MAX_CONCURRENT = int(os.environ.get("ADMISSION_MAX_CONCURRENT", "32"))
+ADMISSION_MAX_CONCURRENT_PER_TENANT = int(os.environ.get("ADMISSION_MAX_CONCURRENT_PER_TENANT", "4"))
+ADMISSION_MAX_CONCURRENT_PER_ENDPOINT = int(os.environ.get("ADMISSION_MAX_CONCURRENT_PER_ENDPOINT", "16"))
+ADMISSION_MAX_QUEUE_LENGTH = int(os.environ.get("ADMISSION_MAX_QUEUE_LENGTH", "256"))
+ADMISSION_MAX_QUEUED_PER_TENANT = int(os.environ.get("ADMISSION_MAX_QUEUED_PER_TENANT", "2"))
+ADMISSION_MAX_QUEUED_PER_ENDPOINT = int(os.environ.get("ADMISSION_MAX_QUEUED_PER_ENDPOINT", "4"))
+ADMISSION_PRIORITIES = ("interactive", "bulk") # Lower index is served first
+ADMISSION_QUEUE_DEADLINE_SECONDS = {
+    "interactive": float(os.environ.get("ADMISSION_INTERACTIVE_DEADLINE_SECONDS", "5")),
+    "bulk": float(os.environ.get("ADMISSION_BULK_DEADLINE_SECONDS", "60"))
+}
+ADMISSION_INTERACTIVE_ENDPOINTS = {"sheets_get_values", "sheets_batch_get_values", "sheets_get_metadata"}
+ADMISSION_WAIT_SAMPLE_SIZE = 1000
+
+_admission_condition = threading.Condition()
+_admission_sequence = itertools.count()
+_admission_waiters = [] # Sorted (priority_rank, sequence, tenant_key, endpoint_name)
+_admission_in_flight = {"total": 0, "tenant": {}, "endpoint": {}, "priority": {}}
+_admission_hold_seconds_ewma = {} # endpoint_name -> smoothed time a slot is held, used for Retry-After
+_admission_metrics = {p: {"admitted": 0, "shed": 0, "wait_seconds": deque(maxlen=ADMISSION_WAIT_SAMPLE_SIZE)} for p in ADMISSION_PRIORITIES}
+
+def _admission_fits(tenant_key, endpoint_name):
+    return (_admission_in_flight["total"] < ADMISSION_MAX_CONCURRENT
+            and _admission_in_flight["tenant"].get(tenant_key, 0) < ADMISSION_MAX_CONCURRENT_PER_TENANT
+            and _admission_in_flight["endpoint"].get(endpoint_name, 0) < ADMISSION_MAX_CONCURRENT_PER_ENDPOINT)
+
+def admission_retry_after_seconds(endpoint_name):
+    return max(1, math.ceil(_admission_hold_seconds_ewma.get(endpoint_name, 1.0)))
+
+def _admission_queue_full(tenant_key, endpoint_name, priority):
+    """True if queueing this request would take a worker thread it is not allowed to hold."""
+    if len(_admission_waiters) >= ADMISSION_MAX_QUEUE_LENGTH: return True
+    if sum(1 for w in _admission_waiters if w[2] == tenant_key) >= ADMISSION_MAX_QUEUED_PER_TENANT: return True
+    if sum(1 for w in _admission_waiters if w[3] == endpoint_name) >= ADMISSION_MAX_QUEUED_PER_ENDPOINT: return True
+    if priority == "bulk":
+        bulk_rank = ADMISSION_PRIORITIES.index("bulk")
+        bulk_threads = _admission_in_flight["priority"].get("bulk", 0) + sum(1 for w in _admission_waiters if w[0] == bulk_rank)
+        if bulk_threads >= ADMISSION_WORKER_THREADS - ADMISSION_RESERVED_INTERACTIVE_THREADS: return True
+    return False
+
+def admission_acquire(tenant_key, endpoint_name, priority):
+    """Blocks until the request is admitted. Returns the queue wait in seconds, or None if the request was shed."""
+    start_time = time.time()
+    deadline = start_time + ADMISSION_QUEUE_DEADLINE_SECONDS[priority]
+    metrics = _admission_metrics[priority]
+    with _admission_condition:
+        if _admission_queue_full(tenant_key, endpoint_name, priority):
+            metrics["shed"] += 1
+            return None
+        entry = (ADMISSION_PRIORITIES.index(priority), next(_admission_sequence), tenant_key, endpoint_name)
+        bisect.insort(_admission_waiters, entry)
+        while True:
+            first_admissible = next((w for w in _admission_waiters if _admission_fits(w[2], w[3])), None)
+            if first_admissible is entry:
+                _admission_waiters.remove(entry)
+                _admission_in_flight["total"] += 1
+                _admission_in_flight["tenant"][tenant_key] = _admission_in_flight["tenant"].get(tenant_key, 0) + 1
+                _admission_in_flight["endpoint"][endpoint_name] = _admission_in_flight["endpoint"].get(endpoint_name, 0) + 1
+                _admission_in_flight["priority"][priority] = _admission_in_flight["priority"].get(priority, 0) + 1
+                wait_seconds = time.time() - start_time
+                metrics["admitted"] += 1; metrics["wait_seconds"].append(wait_seconds)
+                _admission_condition.notify_all() # Others behind us may still fit (different tenant/endpoint)
+                return wait_seconds
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                _admission_waiters.remove(entry)
+                metrics["shed"] += 1
+                _admission_condition.notify_all()
+                return None
+            _admission_condition.wait(remaining)
+
+def admission_release(tenant_key, endpoint_name, priority, held_seconds):
+    with _admission_condition:
+        _admission_in_flight["total"] -= 1
+        for bucket, key in (("tenant", tenant_key), ("endpoint", endpoint_name), ("priority", priority)):
+            _admission_in_flight[bucket][key] -= 1
+            if not _admission_in_flight[bucket][key]: del _admission_in_flight[bucket][key]
+        previous = _admission_hold_seconds_ewma.get(endpoint_name, held_seconds)
+        _admission_hold_seconds_ewma[endpoint_name] = 0.8 * previous + 0.2 * held_seconds
+        _admission_condition.notify_all()
+
+def admission_metrics_snapshot():
+    with _admission_condition:
+        snapshot = {
+            "enabled": ADMISSION_CONTROL_ENABLED,
+            "in_flight": {"total": _admission_in_flight["total"], "by_endpoint": dict(_admission_in_flight["endpoint"]), "by_priority": dict(_admission_in_flight["priority"]), "tenants": len(_admission_in_flight["tenant"])},
+            "queued": {p: sum(1 for w in _admission_waiters if w[0] == rank) for rank, p in enumerate(ADMISSION_PRIORITIES)},
+            "priorities": {}
+        }
+        for priority, metrics in _admission_metrics.items():
+            waits = sorted(metrics["wait_seconds"])
+            snapshot["priorities"][priority] = {
+                "admitted": metrics["admitted"], "shed": metrics["shed"],
+                "queue_wait_ms": {
+                    "p50": round(waits[len(waits) // 2] * 1000, 2) if waits else None,
+                    "p95": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000, 2) if waits else None,
+                    "max": round(waits[-1] * 1000, 2) if waits else None,
+                    "samples": len(waits)
+                }
+            }
+    return snapshot
+
 # --- Flask Endpoints ---
 def handle_google_api_request(endpoint_name, required_fields_body, process_logic_func):
     logger.info(f"ENDPOINT {endpoint_name}: Request received.")
     start_time_total = time.time()
+    admitted_slot = None
     try:
         data = request.json; logger.debug(f"ENDPOINT {endpoint_name}: Request body: {data}")
         # Ensure 'refresh_token' is always implicitly required by this handler
@@ -472,12 +1171,31 @@ def handle_google_api_request(endpoint_name, required_fields_body, process_logic
             return jsonify({"success": False, "error": f"Missing one or more required fields: {', '.join(missing)}"}), 400
         refresh_token = data['refresh_token']
 
-        time_before_token = time.time(); access_token = get_access_token(refresh_token); logger.info(f"ENDPOINT {endpoint_name}: Access token acquisition took {time.time() - time_before_token:.2f}s.")
-        time_before_service = time.time(); service = get_sheets_service(access_token); logger.info(f"ENDPOINT {endpoint_name}: Sheets service acquisition took {time.time() - time_before_service:.2f}s.")
-        time_before_logic = time.time(); api_result, success_message = process_logic_func(service, data); logger.info(f"ENDPOINT {endpoint_name}: API logic execution took {time.time() - time_before_logic:.2f}s.")
+        if ADMISSION_CONTROL_ENABLED:
+            tenant_key = _refresh_token_hash(refresh_token)
+            priority = "interactive" if endpoint_name in ADMISSION_INTERACTIVE_ENDPOINTS else "bulk"
+            with trace_span("admission.queue", **{"admission.priority": priority, "admission.tenant": tenant_key}) as admission_span:
+                queue_wait = admission_acquire(tenant_key, endpoint_name, priority)
+                set_span_attributes(admission_span, **{"admission.queue_wait_ms": round(queue_wait * 1000, 2) if queue_wait is not None else None, "admission.shed": queue_wait is None})
+            if queue_wait is None:
+                retry_after = admission_retry_after_seconds(endpoint_name)
+                logger.warning(f"ENDPOINT {endpoint_name}: Shed {priority} request for tenant {tenant_key} after {time.time() - start_time_total:.2f}s in queue; Retry-After {retry_after}s.")
+                return jsonify({"success": False, "error": "Too many requests", "details": "Server is at capacity for this tenant or endpoint; retry later."}), 429, {"Retry-After": str(retry_after)}
+            admitted_slot = (tenant_key, endpoint_name, priority, time.time())
+            logger.info(f"ENDPOINT {endpoint_name}: Admitted as {priority} after {queue_wait * 1000:.1f}ms queue wait.")
+
+        with trace_span("oauth.token_refresh", kind="CLIENT"):
+            time_before_token = time.time(); access_token = get_access_token(refresh_token); logger.info(f"ENDPOINT {endpoint_name}: Access token acquisition took {time.time() - time_before_token:.2f}s.")
+        with trace_span("sheets.build_service"):
+            time_before_service = time.time(); service = get_sheets_service(access_token); logger.info(f"ENDPOINT {endpoint_name}: Sheets service acquisition took {time.time() - time_before_service:.2f}s.")
+        with trace_span("process_logic", **{"endpoint": endpoint_name}):
+            time_before_logic = time.time(); api_result, success_message = process_logic_func(service, data); logger.info(f"ENDPOINT {endpoint_name}: API logic execution took {time.time() - time_before_logic:.2f}s.")
 
         logger.info(f"ENDPOINT {endpoint_name}: {success_message} (Total time: {time.time() - start_time_total:.2f}s).")
-        return jsonify({"success": True, "message": success_message, "details": api_result})
+        with trace_span("serialize_response") as serialize_span:
+            response = jsonify({"success": True, "message": success_message, "details": api_result})
+            set_span_attributes(serialize_span, **{"http.response_content_length": response.content_length})
+        return response
     except HttpError as e:
         error_content = e.content.decode('utf-8') if hasattr(e, 'content') and e.content else str(e); status_code = e.resp.status if hasattr(e, 'resp') else 500
         logger.error(f"ENDPOINT {endpoint_name}: Google API HttpError: {error_content} (Total time: {time.time() - start_time_total:.2f}s)", exc_info=True)
@@ -496,6 +1214,35 @@ def handle_google_api_request(endpoint_name, required_fields_body, process_logic
     except Exception as e:
         logger.critical(f"ENDPOINT {endpoint_name}: Unhandled generic exception: {str(e)} (Total time: {time.time() - start_time_total:.2f}s)", exc_info=True)
         return jsonify({"success": False, "error": "An unexpected error occurred", "details": str(e)}), 500
+    finally:
+        if admitted_slot is not None:
+            admission_release(admitted_slot[0], admitted_slot[1], admitted_slot[2], time.time() - admitted_slot[3])
+
+@app.before_request
+def _tracing_before_request():
+    if not TRACING_ENABLED: return
+    route = request.url_rule.rule if request.url_rule else request.path
+    g.trace_span = start_span(f"{request.method} {route}", kind="SERVER", parent=_parse_traceparent(request.headers.get("traceparent")), **{
+        "http.method": request.method, "http.route": route, "http.target": request.path,
+        "http.request_content_length": request.content_length or 0
+    })
+
+@app.after_request
+def _tracing_after_request(response):
+    span, _ = g.get("trace_span", (None, None))
+    if span is not None:
+        set_span_attributes(span, **{"http.status_code": response.status_code, "http.response_content_length": response.content_length})
+        response.headers["traceparent"] = f"00-{span['trace_id']}-{span['span_id']}-01"
+    return response
+
+@app.teardown_request
+def _tracing_teardown_request(error=None):
+    span, context_token = g.pop("trace_span", (None, None))
+    end_span(span, context_token, error)
+
+@app.route('/metrics/admission', methods=['GET'])
+def admission_metrics():
+    return jsonify({"success": True, "details": admission_metrics_snapshot()})
 
 # --- OAuth Callback Endpoint ---
 @app.route('/auth/callback', methods=['GET'])
@@ -616,6 +1363,8 @@ def sheets_append_values():
             data.get('response_date_time_render_option', "SERIAL_NUMBER")
         )
         return result, "Values appended successfully."
+    if (request.get_json(silent=True) or {}).get('durable'):
+        return handle_durable_write_request("sheets_append_values", "append", ['spreadsheet_id', 'range_name', 'values_data'])
     return handle_google_api_request("sheets_append_values", ['spreadsheet_id', 'range_name', 'values_data'], process_logic)
 
 @app.route('/sheets/values/clear', methods=['POST'])
@@ -651,13 +1400,51 @@ def sheets_get_metadata():
         return result, "Spreadsheet metadata retrieved successfully."
     return handle_google_api_request("sheets_get_metadata", ['spreadsheet_id'], process_logic)
 
+@app.route('/sheets/copyTo', methods=['POST'])
+def sheets_copy_sheet_to():
+    def process_logic(service, data):
+        result = api_copy_sheet_to(service, data['spreadsheet_id'], data['sheet_id'], data['destination_spreadsheet_id'])
+        return result, "Sheet copied to destination spreadsheet successfully."
+    return handle_google_api_request("sheets_copy_sheet_to", ['spreadsheet_id', 'sheet_id', 'destination_spreadsheet_id'], process_logic)
+
 @app.route('/sheets/batchUpdate', methods=['POST'])
 def sheets_batch_update_requests(): # Generic batch update endpoint
     def process_logic(service, data):
-        result = api_batch_update(service, data['spreadsheet_id'], data['requests_list'])
+        if data.get('optimize', False):
+            result = api_batch_update_optimized(service, data['spreadsheet_id'], data['requests_list'], data.get('max_payload_bytes', BATCH_UPDATE_MAX_PAYLOAD_BYTES))
+        else:
+            result = api_batch_update(service, data['spreadsheet_id'], data['requests_list'])
         return result, "Batch update requests processed successfully."
+    if (request.get_json(silent=True) or {}).get('durable'):
+        return handle_durable_write_request("sheets_batch_update_requests", "batchUpdate", ['spreadsheet_id', 'requests_list'])
     return handle_google_api_request("sheets_batch_update_requests", ['spreadsheet_id', 'requests_list'], process_logic)
 
+@app.route('/sheets/compact/updateCells', methods=['POST'])
+def sheets_compact_update_cells():
+    def process_logic(service, data):
+        time_before_expand, cpu_before_expand = time.time(), time.thread_time()
+        requests_list, strategy = build_compact_update_cells_requests(
+            data['sheet_id'], data['values'],
+            data.get('templates'), data.get('template_index'), data.get('column_templates'),
+            data.get('start_row_index', 0), data.get('start_column_index', 0)
+        )
+        expansion_ms, expansion_cpu_ms = (time.time() - time_before_expand) * 1000, (time.thread_time() - cpu_before_expand) * 1000
+        encoding_stats = {
+            "strategy": strategy,
+            "request_count": len(requests_list),
+            "compact_body_bytes": request.content_length or len(request.get_data()),
+            "expanded_body_bytes": len(json.dumps({"requests": requests_list})), # As the client library serializes it
+            "expansion_ms": round(expansion_ms, 2),
+            "expansion_cpu_ms": round(expansion_cpu_ms, 2)
+        }
+        # Large matrices are sent as several batchUpdates (applied in order, not atomic as a whole).
+        batches = _split_into_batches(requests_list, BATCH_UPDATE_MAX_PAYLOAD_BYTES)
+        encoding_stats["batches"] = len(batches)
+        logger.info(f"ENDPOINT sheets_compact_update_cells: Expanded compact payload in {expansion_ms:.2f}ms: {encoding_stats}")
+        results = [api_batch_update(service, data['spreadsheet_id'], batch) for batch in batches]
+        return {"batch_results": results, "encoding_stats": encoding_stats}, "Compact update cells processed successfully."
+    return handle_google_api_request("sheets_compact_update_cells", ['spreadsheet_id', 'sheet_id', 'values'], process_logic)
+
 
 # --- Specific User Endpoint Example ---
 @app.route('/sheets/specific/metadata/get', methods=['POST'])
@@ -800,42 +1587,1003 @@ operations_for_endpoints = [
     ("updateSlicerSpec", build_update_slicer_spec_request, "Update slicer spec"),
 ]
 
-for route_name_suffix, build_function_ref, operation_description_str in operations_for_endpoints:
-    all_params_for_build, required_params_for_build = get_func_params(build_function_ref)
-
-    # Factory to create the actual Flask view function with correct closures
-    def create_view_function(bf_ref, all_bf_params, req_bf_params, op_desc, rt_suffix):
-        def view_func():
-            process_logic_for_endpoint = _create_batch_op_process_logic(
-                bf_ref,
-                all_bf_params, # Pass all params the build_function can accept
-                op_desc
-            )
-            endpoint_name_for_handler = f"sheets_op_{rt_suffix}"
-            # required_fields_body for handle_google_api_request should include spreadsheet_id
-            # and the actual non-optional params of the build_function_ref.
-            # refresh_token is handled by handle_google_api_request implicitly.
-            required_fields_for_handler = ['spreadsheet_id'] + req_bf_params
-            return handle_google_api_request(
-                endpoint_name_for_handler,
-                required_fields_for_handler,
-                process_logic_for_endpoint
-            )
-        # Give a unique name to the function for Flask's internal routing map
-        view_func.__name__ = f"dynamic_op_endpoint_{rt_suffix}"
-        return view_func
-
-    flask_view_func = create_view_function(
-        build_function_ref,
-        all_params_for_build,
-        required_params_for_build,
-        operation_description_str,
-        route_name_suffix
+# Factory to create the actual Flask view function with correct closures
+def create_view_function(bf_ref, all_bf_params, req_bf_params, op_desc, rt_suffix):
+    def view_func():
+        process_logic_for_endpoint = _create_batch_op_process_logic(
+            bf_ref,
+            all_bf_params, # Pass all params the build_function can accept
+            op_desc
+        )
+        endpoint_name_for_handler = f"sheets_op_{rt_suffix}"
+        # required_fields_body for handle_google_api_request should include spreadsheet_id
+        # and the actual non-optional params of the build_function_ref.
+        # refresh_token is handled by handle_google_api_request implicitly.
+        required_fields_for_handler = ['spreadsheet_id'] + req_bf_params
+        return handle_google_api_request(
+            endpoint_name_for_handler,
+            required_fields_for_handler,
+            process_logic_for_endpoint
+        )
+    # Give a unique name to the function for Flask's internal routing map
+    view_func.__name__ = f"dynamic_op_endpoint_{rt_suffix}"
+    return view_func
+
+def build_op_route_table():
+    """Returns one [route_suffix, build_function_name, description, all_params, required_params] row per /sheets/op/* endpoint."""
+    route_table = []
+    for route_name_suffix, build_function_ref, operation_description_str in operations_for_endpoints:
+        all_params_for_build, required_params_for_build = get_func_params(build_function_ref)
+        route_table.append([route_name_suffix, build_function_ref.__name__, operation_description_str, all_params_for_build, required_params_for_build])
+    return route_table
+
+def _load_startup_artifact_routes():
+    routes_path = os.path.join(STARTUP_ARTIFACT_DIR, STARTUP_ARTIFACT_ROUTES_FILE)
+    if not os.path.exists(routes_path):
+        logger.warning(f"FAST_COLD_START is set but '{routes_path}' does not exist; registering routes by introspection.")
+        return None
+    with open(routes_path, encoding='utf-8') as f: route_table = json.load(f)
+    if not isinstance(route_table, dict) or route_table.get("fingerprint") != _op_route_fingerprint():
+        logger.warning(f"Startup artifact '{routes_path}' does not match the current operations or builder signatures; registering routes by introspection.")
+        return None
+    return route_table["routes"]
+
+def _op_route_fingerprint():
+    """
+    Hash of every operation's route, builder name and parameter list, read from the code objects
+    (much cheaper than inspect.signature), so a stale artifact is detected at startup.
+    """
+    signatures = []
+    for route_name_suffix, build_function_ref, _ in operations_for_endpoints:
+        code = build_function_ref.__code__
+        signatures.append([route_name_suffix, build_function_ref.__name__, code.co_varnames[:code.co_argcount + code.co_kwonlyargcount],
+                           len(build_function_ref.__defaults__ or ()), sorted(build_function_ref.__kwdefaults__ or {}), code.co_flags & (inspect.CO_VARARGS | inspect.CO_VARKEYWORDS)])
+    return hashlib.sha256(json.dumps(signatures).encode('utf-8')).hexdigest()
+
+def write_startup_artifact(artifact_dir=STARTUP_ARTIFACT_DIR):
+    os.makedirs(artifact_dir, exist_ok=True)
+    with open(os.path.join(artifact_dir, STARTUP_ARTIFACT_ROUTES_FILE), 'w', encoding='utf-8') as f:
+        json.dump({"fingerprint": _op_route_fingerprint(), "routes": build_op_route_table()}, f)
+    _load_google_client_libs()
+    from googleapiclient.discovery_cache import get_static_doc
+    discovery_document = _prepare_discovery_document(json.loads(get_static_doc("sheets", "v4")))
+    with open(os.path.join(artifact_dir, STARTUP_ARTIFACT_DISCOVERY_FILE), 'w', encoding='utf-8') as f:
+        json.dump(discovery_document, f, separators=(',', ':'))
+    logger.info(f"Startup artifact written to '{artifact_dir}'.")
+
+_op_route_table = _load_startup_artifact_routes() if FAST_COLD_START else None
+if _op_route_table is not None:
+    # Startup-optimized: one URL rule for all operations; each view function is created on first use.
+    _op_routes_by_suffix = {row[0]: row for row in _op_route_table}
+    _op_view_functions = {}
+
+    @app.route('/sheets/op/<route_name_suffix>', methods=['POST'])
+    def sheets_op_dispatch(route_name_suffix):
+        flask_view_func = _op_view_functions.get(route_name_suffix)
+        if flask_view_func is None:
+            route = _op_routes_by_suffix.get(route_name_suffix)
+            if route is None:
+                return jsonify({"success": False, "error": f"Unknown operation: {route_name_suffix}"}), 404
+            rt_suffix, build_function_name, op_desc, all_bf_params, req_bf_params = route
+            flask_view_func = create_view_function(globals()[build_function_name], all_bf_params, req_bf_params, op_desc, rt_suffix)
+            _op_view_functions[route_name_suffix] = flask_view_func
+        return flask_view_func()
+else:
+    for route_name_suffix, build_function_name, operation_description_str, all_params_for_build, required_params_for_build in build_op_route_table():
+        flask_view_func = create_view_function(
+            globals()[build_function_name],
+            all_params_for_build,
+            required_params_for_build,
+            operation_description_str,
+            route_name_suffix
+        )
+        app.add_url_rule(f'/sheets/op/{route_name_suffix}', view_func=flask_view_func, methods=['POST'])
+
+
+# --- Change-Detection Watcher (push delivery via SSE / webhooks) ---
+# Clients register ranges instead of polling /sheets/values/get themselves. Every
+# (spreadsheet, credential) target is read with ONE values.batchGet covering all of its
+# registered ranges, on an adaptive schedule (fast after a change, backing off while idle).
+# Rows are hashed in blocks; only blocks whose hash changed are diffed cell by cell and
+# only the changed cells are pushed to subscribers. An SSE watch lives as long as its
+# stream: it is unregistered when the client disconnects, or if no client opens the stream
+# within WATCH_SSE_CONNECT_TIMEOUT_SECONDS. A webhook watch expires after WATCH_WEBHOOK_TTL_SECONDS
+# (register again to extend it) or after WATCH_WEBHOOK_MAX_FAILURES consecutive failed deliveries,
+# and every watch on a target is dropped after WATCH_MAX_CONSECUTIVE_POLL_ERRORS failed polls in a
+# row (e.g. a revoked refresh token). State is per-process: run the app with a single worker
+# process (threads are fine) when using the watcher.
+WATCH_MIN_INTERVAL_SECONDS = float(os.environ.get("WATCH_MIN_INTERVAL_SECONDS", "2"))
+WATCH_MAX_INTERVAL_SECONDS = float(os.environ.get("WATCH_MAX_INTERVAL_SECONDS", "60"))
+WATCH_BACKOFF_FACTOR = 1.5
+WATCH_ROW_BLOCK_SIZE = int(os.environ.get("WATCH_ROW_BLOCK_SIZE", "50"))
+WATCH_TOKEN_TTL_SECONDS = 3000 # Access tokens live 3600s; rebuild the service a little before expiry
+WATCH_SUBSCRIBER_QUEUE_SIZE = 1000
+WATCH_SSE_KEEPALIVE_SECONDS = 15
+WATCH_SSE_CONNECT_TIMEOUT_SECONDS = int(os.environ.get("WATCH_SSE_CONNECT_TIMEOUT_SECONDS", "300")) # SSE-only watches nobody streams are dropped after this
+WATCH_WEBHOOK_TTL_SECONDS = int(os.environ.get("WATCH_WEBHOOK_TTL_SECONDS", str(24 * 3600)))
+WATCH_WEBHOOK_MAX_FAILURES = int(os.environ.get("WATCH_WEBHOOK_MAX_FAILURES", "10"))
+WATCH_MAX_CONSECUTIVE_POLL_ERRORS = int(os.environ.get("WATCH_MAX_CONSECUTIVE_POLL_ERRORS", "10"))
+WATCH_WEBHOOK_ALLOWED_HOSTS = [h.strip() for h in os.environ.get("WATCH_WEBHOOK_ALLOWED_HOSTS", "localhost,127.0.0.1").split(",") if h.strip()]
+
+_watch_lock = threading.Lock()
+_watch_wakeup = threading.Event()
+_watch_targets = {} # (spreadsheet_id, refresh_token_hash) -> target state
+_watch_subscriptions = {} # watch_id -> subscription
+_watch_thread = None
+_watch_webhook_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="watch-webhook")
+
+def _watch_block_hashes(rows):
+    hashes = []
+    for block_start in range(0, len(rows), WATCH_ROW_BLOCK_SIZE):
+        block = rows[block_start:block_start + WATCH_ROW_BLOCK_SIZE]
+        hashes.append(hashlib.blake2b(json.dumps(block, separators=(',', ':')).encode('utf-8'), digest_size=16).hexdigest())
+    return hashes
+
+def _watch_diff_rows(old_rows, new_rows, old_hashes, new_hashes):
+    """Returns the changed cells (offsets relative to the watched range), only looking inside row blocks whose hash differs."""
+    changes = []
+    for block_index in range(max(len(old_hashes), len(new_hashes))):
+        if block_index < len(old_hashes) and block_index < len(new_hashes) and old_hashes[block_index] == new_hashes[block_index]:
+            continue
+        block_start = block_index * WATCH_ROW_BLOCK_SIZE
+        block_end = min(block_start + WATCH_ROW_BLOCK_SIZE, max(len(old_rows), len(new_rows)))
+        for row_offset in range(block_start, block_end):
+            old_row = old_rows[row_offset] if row_offset < len(old_rows) else []
+            new_row = new_rows[row_offset] if row_offset < len(new_rows) else []
+            for column_offset in range(max(len(old_row), len(new_row))):
+                old_value = old_row[column_offset] if column_offset < len(old_row) else ""
+                new_value = new_row[column_offset] if column_offset < len(new_row) else ""
+                if old_value != new_value:
+                    changes.append({"row_offset": row_offset, "column_offset": column_offset, "value": new_value})
+    return changes
+
+def _watch_webhook_allowed(webhook_url):
+    parsed = urlparse(webhook_url)
+    return parsed.scheme in ("http", "https") and parsed.hostname in WATCH_WEBHOOK_ALLOWED_HOSTS
+
+def _watch_post_webhook(subscription, webhook_url, event):
+    try:
+        response = requests.post(webhook_url, json=event, timeout=REQUEST_TIMEOUT_SECONDS)
+        response.raise_for_status()
+        subscription["webhook_failures"] = 0
+    except Exception as e:
+        subscription["webhook_failures"] += 1
+        logger.warning(f"WATCH: Webhook delivery to '{webhook_url}' failed for watch '{event.get('watch_id')}' ({subscription['webhook_failures']} in a row): {str(e)}")
+        if subscription["webhook_failures"] >= WATCH_WEBHOOK_MAX_FAILURES:
+            if subscription["queue"] is not None and subscription["stream_connected"]:
+                subscription["webhook_url"] = None # The SSE stream is still being consumed; stop only the webhook
+                logger.warning(f"WATCH: Disabled webhook delivery for watch '{subscription['watch_id']}' after {WATCH_WEBHOOK_MAX_FAILURES} failures.")
+            else:
+                logger.warning(f"WATCH: Unregistering watch '{subscription['watch_id']}' after {WATCH_WEBHOOK_MAX_FAILURES} failed webhook deliveries.")
+                watch_unregister(subscription["watch_id"])
+
+def _watch_deliver(subscription, event_type, payload):
+    event = {
+        "event": event_type, "watch_id": subscription["watch_id"],
+        "spreadsheet_id": subscription["spreadsheet_id"], "range_name": subscription["range_name"],
+        "timestamp": time.time()
+    }
+    event.update(payload)
+    subscriber_queue = subscription["queue"]
+    if subscriber_queue is not None:
+        try:
+            subscriber_queue.put_nowait(event)
+        except queue.Full: # Slow SSE consumer: drop the oldest event rather than block the poller
+            try: subscriber_queue.get_nowait()
+            except queue.Empty: pass
+            try: subscriber_queue.put_nowait(event)
+            except queue.Full: logger.warning(f"WATCH: Dropped event for slow subscriber '{subscription['watch_id']}'.")
+    if subscription["webhook_url"]:
+        _watch_webhook_executor.submit(_watch_post_webhook, subscription, subscription["webhook_url"], event)
+
+def _watch_close_queue(subscriber_queue):
+    """Puts the end-of-stream marker without blocking, making room by dropping the oldest event if the queue is full."""
+    while True:
+        try:
+            subscriber_queue.put_nowait(None); return
+        except queue.Full:
+            try: subscriber_queue.get_nowait()
+            except queue.Empty: pass
+
+def _watch_reap_unconsumed():
+    """
+    Unregisters SSE-only watches whose stream was never opened and webhook watches past their lifetime,
+    so abandoned registrations stop costing Google reads.
+    """
+    now = time.time()
+    cutoff = now - WATCH_SSE_CONNECT_TIMEOUT_SECONDS
+    with _watch_lock:
+        unconsumed = [s["watch_id"] for s in _watch_subscriptions.values()
+                      if s["queue"] is not None and not s["webhook_url"] and not s["stream_connected"] and s["created_at"] < cutoff]
+        expired = [s["watch_id"] for s in _watch_subscriptions.values() if s["expires_at"] is not None and s["expires_at"] <= now]
+    for watch_id in unconsumed:
+        logger.info(f"WATCH: No SSE client connected to watch '{watch_id}' within {WATCH_SSE_CONNECT_TIMEOUT_SECONDS}s; unregistering it.")
+        watch_unregister(watch_id)
+    for watch_id in expired:
+        logger.info(f"WATCH: Webhook watch '{watch_id}' reached its {WATCH_WEBHOOK_TTL_SECONDS}s lifetime; unregistering it.")
+        watch_unregister(watch_id)
+
+def _watch_get_service(target):
+    now = time.time()
+    if target["service"] is None or now >= target["service_expires_at"]:
+        access_token = get_access_token(target["refresh_token"])
+        target["service"] = get_sheets_service(access_token)
+        target["service_expires_at"] = now + WATCH_TOKEN_TTL_SECONDS
+    return target["service"]
+
+def _watch_poll_target(target_key, target):
+    with _watch_lock:
+        range_names = list(target["ranges"].keys())
+    if not range_names:
+        return False
+    service = _watch_get_service(target)
+    result = api_batch_get_values(service, target["spreadsheet_id"], range_names)
+    target["reads"] += 1
+
+    changed_ranges = {}
+    for range_name, value_range in zip(range_names, result.get("valueRanges", [])):
+        new_rows = value_range.get("values", [])
+        new_hashes = _watch_block_hashes(new_rows)
+        with _watch_lock:
+            range_state = target["ranges"].get(range_name)
+        if range_state is None: # Unregistered while the read was in flight
+            continue
+        if range_state["values"] is not None and new_hashes != range_state["block_hashes"]:
+            changes = _watch_diff_rows(range_state["values"], new_rows, range_state["block_hashes"], new_hashes)
+            if changes:
+                changed_ranges[range_name] = changes
+        range_state["values"], range_state["block_hashes"] = new_rows, new_hashes
+
+    with _watch_lock:
+        subscriptions = [s for s in _watch_subscriptions.values() if s["target_key"] == target_key]
+    for subscription in subscriptions:
+        range_state = target["ranges"].get(subscription["range_name"])
+        if range_state is None or range_state["values"] is None:
+            continue
+        if subscription["needs_snapshot"]:
+            subscription["needs_snapshot"] = False
+            _watch_deliver(subscription, "snapshot", {"values": range_state["values"]})
+        elif subscription["range_name"] in changed_ranges:
+            _watch_deliver(subscription, "change", {"changes": changed_ranges[subscription["range_name"]]})
+    if changed_ranges:
+        logger.info(f"WATCH: Spreadsheet '{target['spreadsheet_id']}' changed in {len(changed_ranges)} range(s); notified {len(subscriptions)} subscriber(s).")
+    return bool(changed_ranges)
+
+def _watch_loop():
+    logger.info("WATCH: Poller thread started.")
+    while True:
+        _watch_reap_unconsumed()
+        now = time.time()
+        with _watch_lock:
+            due_targets = [(key, target) for key, target in _watch_targets.items() if target["next_poll"] <= now]
+        for target_key, target in due_targets:
+            start_time = time.time()
+            try:
+                with trace_span("watch.poll", **{"sheets.spreadsheet_id": target["spreadsheet_id"], "watch.ranges": len(target["ranges"])}) as poll_span:
+                    changed = _watch_poll_target(target_key, target)
+                    set_span_attributes(poll_span, **{"watch.changed": changed})
+                target["interval"] = WATCH_MIN_INTERVAL_SECONDS if changed else min(target["interval"] * WATCH_BACKOFF_FACTOR, WATCH_MAX_INTERVAL_SECONDS)
+                target["last_error"], target["consecutive_errors"] = None, 0
+            except Exception as e:
+                if isinstance(e, HttpError) and getattr(e, 'resp', None) is not None and e.resp.status == 401:
+                    target["service"] = None # Force a token refresh on the next poll
+                logger.error(f"WATCH: Poll of spreadsheet '{target['spreadsheet_id']}' failed after {time.time() - start_time:.2f}s: {str(e)}")
+                target["interval"] = WATCH_MAX_INTERVAL_SECONDS
+                target["last_error"] = str(e)
+                target["consecutive_errors"] += 1
+                with _watch_lock:
+                    subscriptions = [s for s in _watch_subscriptions.values() if s["target_key"] == target_key]
+                for subscription in subscriptions:
+                    _watch_deliver(subscription, "error", {"error": str(e)})
+                if target["consecutive_errors"] >= WATCH_MAX_CONSECUTIVE_POLL_ERRORS:
+                    logger.warning(f"WATCH: Spreadsheet '{target['spreadsheet_id']}' failed {target['consecutive_errors']} polls in a row; unregistering its {len(subscriptions)} watch(es).")
+                    for subscription in subscriptions:
+                        watch_unregister(subscription["watch_id"])
+            target["next_poll"] = time.time() + target["interval"]
+        with _watch_lock:
+            next_poll = min((t["next_poll"] for t in _watch_targets.values()), default=time.time() + WATCH_MAX_INTERVAL_SECONDS)
+        _watch_wakeup.wait(timeout=max(0.05, next_poll - time.time()))
+        _watch_wakeup.clear()
+
+def _watch_ensure_thread():
+    global _watch_thread
+    with _watch_lock:
+        if _watch_thread is None or not _watch_thread.is_alive():
+            _watch_thread = threading.Thread(target=_watch_loop, name="sheets-watcher", daemon=True)
+            _watch_thread.start()
+
+def watch_register(refresh_token, spreadsheet_id, range_name, webhook_url=None, sse=True):
+    target_key = (spreadsheet_id, _refresh_token_hash(refresh_token))
+    watch_id = uuid.uuid4().hex
+    with _watch_lock:
+        target = _watch_targets.get(target_key)
+        if target is None:
+            target = {
+                "spreadsheet_id": spreadsheet_id, "refresh_token": refresh_token, "ranges": {},
+                "interval": WATCH_MIN_INTERVAL_SECONDS, "next_poll": 0, "service": None,
+                "service_expires_at": 0, "reads": 0, "last_error": None, "consecutive_errors": 0
+            }
+            _watch_targets[target_key] = target
+        if range_name not in target["ranges"]:
+            target["ranges"][range_name] = {"values": None, "block_hashes": None}
+        target["next_poll"] = 0 # Poll promptly so the new subscriber gets its snapshot
+        _watch_subscriptions[watch_id] = {
+            "watch_id": watch_id, "target_key": target_key, "spreadsheet_id": spreadsheet_id,
+            "range_name": range_name, "webhook_url": webhook_url,
+            "queue": queue.Queue(maxsize=WATCH_SUBSCRIBER_QUEUE_SIZE) if sse else None,
+            "needs_snapshot": True, "created_at": time.time(), "stream_connected": False,
+            "expires_at": time.time() + WATCH_WEBHOOK_TTL_SECONDS if webhook_url else None, "webhook_failures": 0
+        }
+        subscriber_count = sum(1 for s in _watch_subscriptions.values() if s["target_key"] == target_key)
+    _watch_ensure_thread()
+    _watch_wakeup.set()
+    logger.info(f"WATCH: Registered watch '{watch_id}' on '{spreadsheet_id}' range '{range_name}' ({subscriber_count} subscriber(s) share this target).")
+    return watch_id, subscriber_count
+
+def watch_unregister(watch_id):
+    with _watch_lock:
+        subscription = _watch_subscriptions.pop(watch_id, None)
+        if subscription is None:
+            return False
+        target_key, range_name = subscription["target_key"], subscription["range_name"]
+        remaining = [s for s in _watch_subscriptions.values() if s["target_key"] == target_key]
+        target = _watch_targets.get(target_key)
+        if target is not None:
+            if not any(s["range_name"] == range_name for s in remaining):
+                target["ranges"].pop(range_name, None)
+            if not remaining:
+                _watch_targets.pop(target_key, None)
+    if subscription["queue"] is not None:
+        _watch_close_queue(subscription["queue"]) # Ends any open SSE stream
+    logger.info(f"WATCH: Unregistered watch '{watch_id}'.")
+    return True
+
+@app.route('/sheets/watch/register', methods=['POST'])
+def sheets_watch_register():
+    endpoint_name = "sheets_watch_register"
+    logger.info(f"ENDPOINT {endpoint_name}: Request received.")
+    data = request.json
+    required_fields = ['refresh_token', 'spreadsheet_id', 'range_name']
+    if not data or not all(k in data for k in required_fields):
+        missing = [k for k in required_fields if not data or k not in data]
+        logger.warning(f"ENDPOINT {endpoint_name}: Missing required fields. Needs: {required_fields}. Missing: {missing}")
+        return jsonify({"success": False, "error": f"Missing one or more required fields: {', '.join(missing)}"}), 400
+    webhook_url = data.get('webhook_url')
+    if webhook_url and not _watch_webhook_allowed(webhook_url):
+        logger.warning(f"ENDPOINT {endpoint_name}: Rejected webhook URL '{webhook_url}'.")
+        return jsonify({"success": False, "error": "ValueError", "details": f"webhook_url host must be one of: {', '.join(WATCH_WEBHOOK_ALLOWED_HOSTS)}"}), 400
+    sse = data.get('sse', not webhook_url)
+    if not sse and not webhook_url:
+        logger.warning(f"ENDPOINT {endpoint_name}: Rejected watch without a delivery channel.")
+        return jsonify({"success": False, "error": "ValueError", "details": "A watch needs a delivery channel: set sse to true or provide webhook_url."}), 400
+    watch_id, subscriber_count = watch_register(data['refresh_token'], data['spreadsheet_id'], data['range_name'], webhook_url, sse)
+    return jsonify({"success": True, "message": "Watch registered successfully.", "details": {
+        "watch_id": watch_id,
+        "stream_url": f"/sheets/watch/stream/{watch_id}" if sse else None,
+        "target_subscribers": subscriber_count,
+        "expires_in_seconds": WATCH_WEBHOOK_TTL_SECONDS if webhook_url else None
+    }})
+
+@app.route('/sheets/watch/unregister', methods=['POST'])
+def sheets_watch_unregister():
+    data = request.json
+    if not data or 'watch_id' not in data:
+        return jsonify({"success": False, "error": "Missing one or more required fields: watch_id"}), 400
+    if not watch_unregister(data['watch_id']):
+        return jsonify({"success": False, "error": "Unknown watch_id"}), 404
+    return jsonify({"success": True, "message": "Watch unregistered successfully."})
+
+@app.route('/sheets/watch/stream/<watch_id>', methods=['GET'])
+def sheets_watch_stream(watch_id):
+    with _watch_lock:
+        subscription = _watch_subscriptions.get(watch_id)
+        if subscription is not None and subscription["queue"] is not None:
+            subscription["stream_connected"] = True
+    if subscription is None or subscription["queue"] is None:
+        return jsonify({"success": False, "error": "Unknown watch_id or watch has no SSE delivery"}), 404
+    subscriber_queue = subscription["queue"]
+    logger.info(f"ENDPOINT sheets_watch_stream: SSE client connected for watch '{watch_id}'.")
+
+    def generate():
+        try:
+            while True:
+                try:
+                    event = subscriber_queue.get(timeout=WATCH_SSE_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                if event is None:
+                    return
+                yield f"event: {event['event']}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            # Runs when the client disconnects too (the server closes the generator): the watch ends with its stream.
+            watch_unregister(watch_id)
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route('/sheets/watch/stats', methods=['GET'])
+def sheets_watch_stats():
+    # Aggregate counts only: this endpoint is unauthenticated and must not reveal other tenants' spreadsheets.
+    with _watch_lock:
+        details = {
+            "targets": len(_watch_targets), "subscriptions": len(_watch_subscriptions),
+            "ranges": sum(len(t["ranges"]) for t in _watch_targets.values()),
+            "google_reads": sum(t["reads"] for t in _watch_targets.values()),
+            "targets_in_error": sum(1 for t in _watch_targets.values() if t["last_error"])
+        }
+    return jsonify({"success": True, "details": details})
+
+
+# --- Sheet Replication / Fan-Out Across Spreadsheets ---
+# Copies one source sheet into many destination spreadsheets. Each destination gets a
+# sheets.copyTo followed by an optional batchUpdate (rename plus caller-supplied requests, where
+# the string "$NEW_SHEET_ID" is replaced by the copied sheet's id). Destinations run on a bounded
+# worker pool, every Google call is paced per credential to stay under the per-user write quota
+# and retried on 429/5xx, and progress is checkpointed per destination so an interrupted job can
+# be resumed by posting its job_id again (already copied sheets are not copied twice).
+# copyTo is not idempotent: the destination's sheet ids are recorded before the first copy, and
+# after an ambiguous failure (5xx, timeout, dropped connection, or a resumed job that may have
+# copied before checkpointing) a fresh "Copy of <source title>" sheet is adopted instead of copying again.
+REPLICATION_MAX_CONCURRENCY = int(os.environ.get("REPLICATION_MAX_CONCURRENCY", "8"))
+REPLICATION_MAX_REQUESTS_PER_MINUTE = float(os.environ.get("REPLICATION_MAX_REQUESTS_PER_MINUTE", "55")) # Sheets default write quota: 60/min per user
+REPLICATION_MAX_ATTEMPTS = 5
+REPLICATION_RETRYABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+REPLICATION_TOKEN_TTL_SECONDS = 3000
+REPLICATION_CHECKPOINT_DIR = os.environ.get("REPLICATION_CHECKPOINT_DIR", os.path.join(tempfile.gettempdir(), "gsheets_replication"))
+NEW_SHEET_ID_PLACEHOLDER = "$NEW_SHEET_ID"
+
+_replication_lock = threading.Lock()
+_replication_jobs = {} # job_id -> job (runtime state + JSON-safe "checkpoint")
+_replication_pacers = {} # refresh_token_hash -> {"lock", "next_request_at"}
+_replication_local = threading.local() # Per worker thread: the service built for the current access token
+
+def _replication_pace(token_hash):
+    with _replication_lock:
+        pacer = _replication_pacers.setdefault(token_hash, {"lock": threading.Lock(), "next_request_at": 0.0})
+    with pacer["lock"]:
+        now = time.time()
+        wait = pacer["next_request_at"] - now
+        pacer["next_request_at"] = max(now, pacer["next_request_at"]) + 60.0 / REPLICATION_MAX_REQUESTS_PER_MINUTE
+    if wait > 0: time.sleep(wait)
+
+def _replication_access_token(job):
+    with job["token_lock"]:
+        if job["access_token"] is None or time.time() >= job["access_token_expires_at"]:
+            job["access_token"] = get_access_token(job["refresh_token"])
+            job["access_token_expires_at"] = time.time() + REPLICATION_TOKEN_TTL_SECONDS
+        return job["access_token"]
+
+def _replication_service(job):
+    # Service objects are not thread-safe and expensive to build, so each worker thread keeps its own.
+    access_token = _replication_access_token(job)
+    if getattr(_replication_local, "access_token", None) != access_token:
+        _replication_local.service = get_sheets_service(access_token)
+        _replication_local.access_token = access_token
+    return _replication_local.service
+
+def _replication_checkpoint_path(job_id):
+    return os.path.join(REPLICATION_CHECKPOINT_DIR, f"{job_id}.json")
+
+def _replication_save_checkpoint(job):
+    checkpoint_path = _replication_checkpoint_path(job["checkpoint"]["job_id"])
+    with job["checkpoint_lock"]:
+        try:
+            os.makedirs(REPLICATION_CHECKPOINT_DIR, exist_ok=True)
+            with open(checkpoint_path + ".tmp", 'w', encoding='utf-8') as f: json.dump(job["checkpoint"], f)
+            os.replace(checkpoint_path + ".tmp", checkpoint_path)
+        except OSError as e:
+            logger.error(f"REPLICATION: Could not write checkpoint '{checkpoint_path}': {str(e)}")
+
+def _replication_update_target(job, destination_id, **fields):
+    with job["checkpoint_lock"]:
+        job["checkpoint"]["targets"][destination_id].update(fields)
+    _replication_save_checkpoint(job)
+
+def _replication_is_transient(error):
+    """Network-level failures worth retrying: timeouts, dropped connections, DNS and TLS errors, throttled/5xx token refreshes."""
+    if isinstance(error, requests.exceptions.HTTPError): # Token endpoint answered; only retry throttling/server errors
+        return error.response is not None and error.response.status_code in REPLICATION_RETRYABLE_STATUS_CODES
+    if isinstance(error, OSError): return True # Includes requests' ConnectionError/Timeout, socket timeouts and ssl.SSLError
+    httplib2 = sys.modules.get("httplib2") # Loaded with the Google client libraries
+    return httplib2 is not None and isinstance(error, httplib2.ServerNotFoundError)
+
+def _replication_call(job, destination_id, api_func, *args, pace=True, before_ambiguous_retry=None):
+    """
+    Runs one Google API call under the credential's write pacing (pace=False for reads), retrying throttling
+    and server errors with backoff. For calls that are not idempotent, before_ambiguous_retry is called before
+    retrying a failure that may have been applied (5xx, timeout, connection error); a non-None result is returned
+    as the call's result instead of retrying.
+    """
+    ambiguous_failure = False
+    for attempt in range(1, REPLICATION_MAX_ATTEMPTS + 1):
+        if ambiguous_failure and before_ambiguous_retry is not None:
+            applied_result = before_ambiguous_retry()
+            if applied_result is not None: return applied_result
+        if pace: _replication_pace(job["token_hash"])
+        try:
+            with trace_span("replication.attempt", **{"replication.destination": destination_id, "replication.operation": api_func.__name__, "replication.attempt": attempt}):
+                return api_func(_replication_service(job), *args)
+        except HttpError as e:
+            status_code = e.resp.status if getattr(e, 'resp', None) is not None else None
+            if status_code == 401:
+                with job["token_lock"]: job["access_token"] = None
+            if attempt == REPLICATION_MAX_ATTEMPTS or (status_code not in REPLICATION_RETRYABLE_STATUS_CODES and status_code != 401):
+                raise
+            ambiguous_failure = ambiguous_failure or (status_code is not None and status_code >= 500)
+        except Exception as e:
+            if attempt == REPLICATION_MAX_ATTEMPTS or not _replication_is_transient(e): raise
+            # requests errors come from the token refresh, before the Google call was sent; anything else may have been applied.
+            # Once an attempt was ambiguous every later retry must check, so the flag is never cleared.
+            ambiguous_failure = ambiguous_failure or not isinstance(e, requests.exceptions.RequestException)
+        delay = min(2 ** attempt, 32) + random.uniform(0, 1)
+        with job["checkpoint_lock"]:
+            job["checkpoint"]["targets"][destination_id]["retries"] += 1
+        logger.warning(f"REPLICATION: {api_func.__name__} for destination '{destination_id}' failed (attempt {attempt}); retrying in {delay:.1f}s.")
+        time.sleep(delay)
+
+def _substitute_new_sheet_id(obj, new_sheet_id):
+    if isinstance(obj, dict): return {k: _substitute_new_sheet_id(v, new_sheet_id) for k, v in obj.items()}
+    if isinstance(obj, list): return [_substitute_new_sheet_id(v, new_sheet_id) for v in obj]
+    return new_sheet_id if obj == NEW_SHEET_ID_PLACEHOLDER else obj
+
+def _replication_find_fresh_copy(job, destination_id):
+    """Returns the properties of a copy of the source sheet created in the destination since the baseline was taken, else None."""
+    checkpoint = job["checkpoint"]
+    baseline = set(checkpoint["targets"][destination_id]["sheet_ids_before_copy"])
+    copy_title = f"Copy of {checkpoint.get('source_sheet_title') or ''}"
+    metadata = _replication_call(job, destination_id, api_get_spreadsheet_metadata, destination_id, "sheets.properties(sheetId,title)", pace=False)
+    fresh_copies = [sheet["properties"] for sheet in metadata.get("sheets", [])
+                    if sheet["properties"]["sheetId"] not in baseline and sheet["properties"].get("title", "").startswith(copy_title)]
+    if fresh_copies:
+        logger.warning(f"REPLICATION: copyTo to destination '{destination_id}' had already been applied; using sheet {fresh_copies[0]['sheetId']} instead of copying again.")
+        return fresh_copies[0]
+    return None
+
+def _replicate_to_destination(job, destination):
+    checkpoint = job["checkpoint"]
+    destination_id = destination["spreadsheet_id"]
+    target = checkpoint["targets"][destination_id]
+    start_time = time.time()
+    try:
+        new_sheet_id = target.get("new_sheet_id")
+        if new_sheet_id is None:
+            copy_result = None
+            if target.get("sheet_ids_before_copy") is None:
+                metadata = _replication_call(job, destination_id, api_get_spreadsheet_metadata, destination_id, "sheets.properties.sheetId", pace=False)
+                _replication_update_target(job, destination_id, sheet_ids_before_copy=[sheet["properties"]["sheetId"] for sheet in metadata.get("sheets", [])])
+            else: # An earlier run got as far as copying; it may have succeeded without being checkpointed
+                copy_result = _replication_find_fresh_copy(job, destination_id)
+            if copy_result is None:
+                copy_result = _replication_call(job, destination_id, api_copy_sheet_to, checkpoint["source_spreadsheet_id"], checkpoint["source_sheet_id"], destination_id,
+                                                before_ambiguous_retry=lambda: _replication_find_fresh_copy(job, destination_id))
+            new_sheet_id = copy_result.get("sheetId")
+            _replication_update_target(job, destination_id, status="copied", new_sheet_id=new_sheet_id)
+        follow_up_requests = []
+        new_sheet_name = destination.get("new_sheet_name") or checkpoint.get("new_sheet_name")
+        if new_sheet_name:
+            follow_up_requests.append(build_update_sheet_properties_request({"sheetId": new_sheet_id, "title": new_sheet_name}, "title"))
+        follow_up_requests += _substitute_new_sheet_id(checkpoint["follow_up_requests"] + destination.get("requests_list", []), new_sheet_id)
+        if follow_up_requests:
+            _replication_call(job, destination_id, api_batch_update, destination_id, follow_up_requests)
+        _replication_update_target(job, destination_id, status="done", error=None, duration_seconds=round(time.time() - start_time, 2))
+    except Exception as e:
+        error_content = e.content.decode('utf-8') if isinstance(e, HttpError) and e.content else str(e)
+        logger.error(f"REPLICATION: Destination '{destination_id}' of job '{checkpoint['job_id']}' failed after {time.time() - start_time:.2f}s: {error_content}")
+        _replication_update_target(job, destination_id, status="failed", error=error_content, duration_seconds=round(time.time() - start_time, 2))
+
+def replication_job_status(checkpoint):
+    targets = checkpoint["targets"]
+    counts = {}
+    for target in targets.values():
+        counts[target["status"]] = counts.get(target["status"], 0) + 1
+    run_elapsed = (checkpoint.get("finished_at") or time.time()) - checkpoint["run_started_at"]
+    done_this_run = counts.get("done", 0) - checkpoint["done_at_run_start"]
+    return {
+        "job_id": checkpoint["job_id"], "status": checkpoint["status"],
+        "total": len(targets), "counts": counts,
+        "elapsed_seconds": round(run_elapsed, 2),
+        "destinations_per_minute": round(done_this_run / run_elapsed * 60, 2) if run_elapsed > 0 else None,
+        "failures": {dest_id: t["error"] for dest_id, t in targets.items() if t["status"] == "failed"},
+        "targets": targets
+    }
+
+def _run_replication_job(job):
+    checkpoint = job["checkpoint"]
+    pending = [d for d in checkpoint["destinations"] if checkpoint["targets"][d["spreadsheet_id"]]["status"] != "done"]
+    logger.info(f"REPLICATION: Job '{checkpoint['job_id']}' starting: {len(pending)} of {len(checkpoint['destinations'])} destination(s) pending, concurrency {checkpoint['max_concurrency']}.")
+    if pending:
+        with trace_span("replication.job", **{"replication.job_id": checkpoint["job_id"], "replication.pending": len(pending)}):
+            # Worker threads do not inherit context variables; hand each task a copy so its spans join this trace.
+            tasks = [(contextvars.copy_context(), destination) for destination in pending]
+            with ThreadPoolExecutor(max_workers=min(checkpoint["max_concurrency"], len(pending)), thread_name_prefix="replication") as executor:
+                list(executor.map(lambda task: task[0].run(_replicate_to_destination, job, task[1]), tasks))
+    with job["checkpoint_lock"]:
+        failed = sum(1 for t in checkpoint["targets"].values() if t["status"] != "done")
+        checkpoint["status"] = "completed_with_errors" if failed else "completed"
+        checkpoint["finished_at"] = time.time()
+    _replication_save_checkpoint(job)
+    logger.info(f"REPLICATION: Job '{checkpoint['job_id']}' finished: {replication_job_status(checkpoint)['counts']} in {checkpoint['finished_at'] - checkpoint['run_started_at']:.2f}s.")
+
+def _replication_load_checkpoint(job_id):
+    with _replication_lock:
+        job = _replication_jobs.get(job_id)
+    if job is not None: return job["checkpoint"]
+    checkpoint_path = _replication_checkpoint_path(job_id)
+    if not os.path.exists(checkpoint_path): return None
+    with open(checkpoint_path, encoding='utf-8') as f: return json.load(f)
+
+def start_replication_job(refresh_token, checkpoint):
+    job = {
+        "checkpoint": checkpoint, "checkpoint_lock": threading.Lock(),
+        "refresh_token": refresh_token, "token_hash": _refresh_token_hash(refresh_token),
+        "token_lock": threading.Lock(), "access_token": None, "access_token_expires_at": 0
+    }
+    with _replication_lock:
+        running = _replication_jobs.get(checkpoint["job_id"])
+        if running is not None and running["checkpoint"]["status"] == "running":
+            raise ValueError(f"Replication job '{checkpoint['job_id']}' is already running.")
+        checkpoint.update({"status": "running", "run_started_at": time.time(), "finished_at": None,
+                           "done_at_run_start": sum(1 for t in checkpoint["targets"].values() if t["status"] == "done")})
+        _replication_jobs[checkpoint["job_id"]] = job
+    _replication_save_checkpoint(job)
+    threading.Thread(target=contextvars.copy_context().run, args=(_run_replication_job, job), name=f"replication-{checkpoint['job_id'][:8]}", daemon=True).start()
+    return job
+
+@app.route('/sheets/replicate', methods=['POST'])
+def sheets_replicate():
+    def process_logic(service, data):
+        job_id = data.get('job_id')
+        if job_id:
+            if not re.fullmatch(r"[0-9a-f]{32}", job_id): raise ValueError("job_id must be a 32-character hex id returned by /sheets/replicate.")
+            checkpoint = _replication_load_checkpoint(job_id)
+            if checkpoint is None: raise ValueError(f"No checkpoint found for replication job '{job_id}'.")
+            message = "Replication job resumed."
+        else:
+            destinations, targets = [], {}
+            for destination in data['destinations']:
+                destination = {"spreadsheet_id": destination} if isinstance(destination, str) else dict(destination)
+                if not destination.get("spreadsheet_id"): raise ValueError("Each destination needs a spreadsheet_id.")
+                if destination["spreadsheet_id"] in targets: continue
+                destinations.append(destination)
+                targets[destination["spreadsheet_id"]] = {"status": "pending", "new_sheet_id": None, "retries": 0, "error": None, "duration_seconds": None}
+            if not destinations: raise ValueError("destinations must contain at least one destination spreadsheet.")
+            checkpoint = {
+                "job_id": uuid.uuid4().hex,
+                "source_spreadsheet_id": data['source_spreadsheet_id'], "source_sheet_id": data['source_sheet_id'],
+                "new_sheet_name": data.get('new_sheet_name'), "follow_up_requests": data.get('follow_up_requests', []),
+                "max_concurrency": max(1, min(int(data.get('max_concurrency', REPLICATION_MAX_CONCURRENCY)), REPLICATION_MAX_CONCURRENCY)),
+                "destinations": destinations, "targets": targets, "created_at": time.time()
+            }
+            # Fail fast on a bad source before fanning out to every destination.
+            source_metadata = api_get_spreadsheet_metadata(service, checkpoint["source_spreadsheet_id"], "sheets.properties(sheetId,title)")
+            source_sheet = next((sheet["properties"] for sheet in source_metadata.get("sheets", []) if str(sheet["properties"]["sheetId"]) == str(checkpoint["source_sheet_id"])), None)
+            if source_sheet is None: raise ValueError(f"Sheet {checkpoint['source_sheet_id']} not found in source spreadsheet '{checkpoint['source_spreadsheet_id']}'.")
+            checkpoint["source_sheet_title"] = source_sheet.get("title")
+            message = "Replication job started."
+        job = start_replication_job(data['refresh_token'], checkpoint)
+        status = replication_job_status(job["checkpoint"])
+        status["status_url"] = f"/sheets/replicate/status/{status['job_id']}"
+        return status, message
+    data = request.json or {}
+    required_fields = ['job_id'] if data.get('job_id') else ['source_spreadsheet_id', 'source_sheet_id', 'destinations']
+    return handle_google_api_request("sheets_replicate", required_fields, process_logic)
+
+@app.route('/sheets/replicate/status/<job_id>', methods=['GET'])
+def sheets_replicate_status(job_id):
+    if not re.fullmatch(r"[0-9a-f]{32}", job_id):
+        return jsonify({"success": False, "error": "Invalid job_id"}), 400
+    checkpoint = _replication_load_checkpoint(job_id)
+    if checkpoint is None:
+        return jsonify({"success": False, "error": "Unknown job_id"}), 404
+    return jsonify({"success": True, "details": replication_job_status(checkpoint)})
+
+
+# --- Durable Outbox (write-ahead journal for appends and batchUpdates) ---
+# With OUTBOX_ENABLED=1, /sheets/values/append and /sheets/batchUpdate accept "durable": true.
+# Such writes are acknowledged (202) as soon as they are committed to a local SQLite journal
+# (WAL + synchronous=FULL, i.e. fsync'd) and do not need Google or the token endpoint to be up.
+# A background drainer replays them in journal order per spreadsheet, folding consecutive
+# compatible entries into one call (appends to the same range, or batchUpdates). Throttling,
+# 5xx and network errors keep the entry at the head of its spreadsheet's queue and back off;
+# other errors move it to 'failed' so later writes are not blocked. The journal stores refresh
+# tokens, so it is created with owner-only permissions.
+# Every worker process sharing the journal runs a drainer. A drainer claims the head of a
+# spreadsheet's queue (status 'in_flight' with an owner and a lease) in a BEGIN IMMEDIATE
+# transaction before replaying it, so each spreadsheet is replayed by one process at a time.
+# Delivery is at-least-once: if a process dies after Google applied a batch but before it was
+# removed from the journal, the batch is replayed once the lease (OUTBOX_LEASE_SECONDS) expires.
+OUTBOX_ENABLED = os.environ.get("OUTBOX_ENABLED", "false").lower() in ("1", "true", "yes")
+OUTBOX_DB_PATH = os.environ.get("OUTBOX_DB_PATH", os.path.join(tempfile.gettempdir(), "gsheets_outbox.sqlite3"))
+OUTBOX_MAX_BATCH_ENTRIES = int(os.environ.get("OUTBOX_MAX_BATCH_ENTRIES", "100"))
+OUTBOX_DRAIN_CONCURRENCY = int(os.environ.get("OUTBOX_DRAIN_CONCURRENCY", "4"))
+OUTBOX_LEASE_SECONDS = int(os.environ.get("OUTBOX_LEASE_SECONDS", "600")) # Must exceed the longest replay (token refresh + Google call)
+OUTBOX_MAX_BACKOFF_SECONDS = 300
+OUTBOX_IDLE_POLL_SECONDS = 5 # Also how quickly entries journaled by other processes are noticed
+OUTBOX_TOKEN_TTL_SECONDS = 3000
+OUTBOX_RATE_WINDOW_SECONDS = 60
+_OUTBOX_APPEND_MERGE_KEYS = ("range_name", "value_input_option", "insert_data_option")
+_OUTBOX_BATCH_UPDATE_MERGE_KEYS = ("optimize",)
+
+_outbox_owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+_outbox_local = threading.local()
+_outbox_init_lock = threading.Lock()
+_outbox_initialized = False
+_outbox_wakeup = threading.Event()
+_outbox_thread = None
+_outbox_draining = set() # spreadsheet_ids submitted to this process's drain pool and not finished yet
+_outbox_draining_lock = threading.Lock()
+_outbox_isolate_head = set() # spreadsheet_ids whose merged batch failed: replay the head entry alone to find the culprit
+_outbox_access_tokens = {} # refresh_token_hash -> (access_token, expires_at)
+_outbox_metrics_lock = threading.Lock()
+_outbox_replayed = deque() # (completed_at, entry_count) within OUTBOX_RATE_WINDOW_SECONDS
+_outbox_replay_lag_seconds = deque(maxlen=1000)
+
+def _outbox_connection():
+    global _outbox_initialized
+    conn = getattr(_outbox_local, "conn", None)
+    if conn is not None: return conn
+    with _outbox_init_lock:
+        if not _outbox_initialized and not os.path.exists(OUTBOX_DB_PATH):
+            os.close(os.open(OUTBOX_DB_PATH, os.O_CREAT | os.O_WRONLY, 0o600))
+        conn = sqlite3.connect(OUTBOX_DB_PATH, timeout=30, isolation_level=None) # Autocommit; explicit transactions below
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=FULL") # fsync the WAL on every commit
+        if not _outbox_initialized:
+            conn.execute("""CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                spreadsheet_id TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                refresh_token TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                next_attempt_at REAL NOT NULL DEFAULT 0,
+                owner TEXT,
+                lease_expires_at REAL,
+                last_error TEXT
+            )""")
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(outbox)")}
+            for column, definition in (("next_attempt_at", "REAL NOT NULL DEFAULT 0"), ("owner", "TEXT"), ("lease_expires_at", "REAL")):
+                if column not in columns: # Journals created before leases were added
+                    conn.execute(f"ALTER TABLE outbox ADD COLUMN {column} {definition}")
+            conn.execute("CREATE INDEX IF NOT EXISTS outbox_pending ON outbox(status, spreadsheet_id, id)")
+            _outbox_initialized = True
+    _outbox_local.conn = conn
+    return conn
+
+def outbox_enqueue(spreadsheet_id, kind, payload, refresh_token):
+    conn = _outbox_connection()
+    cursor = conn.execute(
+        "INSERT INTO outbox (spreadsheet_id, kind, payload, refresh_token, created_at) VALUES (?, ?, ?, ?, ?)",
+        (spreadsheet_id, kind, json.dumps(payload, separators=(',', ':')), refresh_token, time.time())
     )
-    app.add_url_rule(f'/sheets/op/{route_name_suffix}', view_func=flask_view_func, methods=['POST'])
+    _outbox_ensure_drainer()
+    _outbox_wakeup.set()
+    return cursor.lastrowid
+
+def _outbox_access_token(refresh_token):
+    token_hash = _refresh_token_hash(refresh_token)
+    cached = _outbox_access_tokens.get(token_hash)
+    if cached and time.time() < cached[1]: return cached[0]
+    access_token = get_access_token(refresh_token)
+    _outbox_access_tokens[token_hash] = (access_token, time.time() + OUTBOX_TOKEN_TTL_SECONDS)
+    return access_token
+
+def _outbox_is_retryable(error):
+    if isinstance(error, HttpError):
+        status_code = error.resp.status if getattr(error, 'resp', None) is not None else 500
+        return status_code == 429 or status_code >= 500 or status_code == 401
+    if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+        return error.response.status_code == 429 or error.response.status_code >= 500
+    return isinstance(error, (requests.exceptions.RequestException, TimeoutError, ConnectionError, OSError))
+
+def _outbox_take_batch(rows, single_entry):
+    """Returns the longest prefix of pending rows that can be replayed as a single Google API call."""
+    batch, payloads, payload_bytes = [], [], 0
+    for row in rows:
+        entry_id, kind, payload_text, refresh_token = row[0], row[1], row[2], row[3]
+        payload = json.loads(payload_text)
+        if batch:
+            head_kind, head_payload, head_refresh_token = batch[0][1], payloads[0], batch[0][3]
+            merge_keys = _OUTBOX_APPEND_MERGE_KEYS if kind == "append" else _OUTBOX_BATCH_UPDATE_MERGE_KEYS
+            compatible = kind == head_kind and refresh_token == head_refresh_token and all(payload.get(k) == head_payload.get(k) for k in merge_keys)
+            if not compatible or payload_bytes + len(payload_text) > BATCH_UPDATE_MAX_PAYLOAD_BYTES: break
+        batch.append(row); payloads.append(payload); payload_bytes += len(payload_text)
+        if single_entry: break
+    return batch, payloads
+
+def _outbox_claim(conn, spreadsheet_id):
+    """
+    Leases the next batch of the spreadsheet's queue to this process, or returns ([], []) if the head
+    entry is leased by another drainer or still backing off. Expired leases (a drainer that died) are taken over.
+    """
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        rows = conn.execute(
+            "SELECT id, kind, payload, refresh_token, created_at, attempts, status, next_attempt_at, lease_expires_at FROM outbox "
+            "WHERE spreadsheet_id = ? AND status IN ('pending', 'in_flight') ORDER BY id LIMIT ?",
+            (spreadsheet_id, OUTBOX_MAX_BATCH_ENTRIES)
+        ).fetchall()
+        if not rows or (rows[0][6] == 'in_flight' and rows[0][8] > now) or rows[0][7] > now:
+            conn.execute("COMMIT")
+            return [], []
+        batch, payloads = _outbox_take_batch(rows, spreadsheet_id in _outbox_isolate_head)
+        entry_ids = [row[0] for row in batch]
+        conn.execute(f"UPDATE outbox SET status = 'in_flight', owner = ?, lease_expires_at = ? WHERE id IN ({','.join('?' * len(entry_ids))})",
+                     [_outbox_owner, now + OUTBOX_LEASE_SECONDS] + entry_ids)
+        conn.execute("COMMIT")
+        return batch, payloads
+    except BaseException:
+        conn.execute("ROLLBACK"); raise
+
+def _outbox_drain_spreadsheet(spreadsheet_id):
+    conn = _outbox_connection()
+    batch, payloads = _outbox_claim(conn, spreadsheet_id)
+    if not batch: return
+    entry_ids = [row[0] for row in batch]
+    ids_clause = f"id IN ({','.join('?' * len(entry_ids))}) AND owner = ?" # A lost lease must not touch the new owner's rows
+    kind, refresh_token = batch[0][1], batch[0][3]
+    start_time = time.time()
+    try:
+        with trace_span("outbox.replay", **{"sheets.spreadsheet_id": spreadsheet_id, "outbox.kind": kind, "outbox.entries": len(batch)}):
+            service = get_sheets_service(_outbox_access_token(refresh_token))
+            if kind == "append":
+                values_data = [row_values for payload in payloads for row_values in payload["values_data"]]
+                api_append_values(service, spreadsheet_id, payloads[0]["range_name"], values_data,
+                                  payloads[0].get("value_input_option", "USER_ENTERED"), payloads[0].get("insert_data_option", "INSERT_ROWS"))
+            else:
+                requests_list = [req for payload in payloads for req in payload["requests_list"]]
+                if payloads[0].get("optimize", False):
+                    # The merged input is already under the payload limit, so the optimized list is still sent as one atomic call.
+                    requests_list = [req for optimized_batch in optimize_batch_update_requests(requests_list)[0] for req in optimized_batch]
+                api_batch_update(service, spreadsheet_id, requests_list)
+    except Exception as e:
+        error_content = e.content.decode('utf-8') if isinstance(e, HttpError) and e.content else str(e)
+        if isinstance(e, HttpError) and getattr(e, 'resp', None) is not None and e.resp.status == 401:
+            _outbox_access_tokens.pop(_refresh_token_hash(refresh_token), None)
+        if _outbox_is_retryable(e):
+            attempts = batch[0][5] + 1
+            next_attempt_at = time.time() + min(2 ** attempts, OUTBOX_MAX_BACKOFF_SECONDS) + random.uniform(0, 1)
+            conn.execute(f"UPDATE outbox SET status = 'pending', owner = NULL, lease_expires_at = NULL, attempts = attempts + 1, next_attempt_at = ?, last_error = ? WHERE {ids_clause}",
+                         [next_attempt_at, error_content] + entry_ids + [_outbox_owner])
+            logger.warning(f"OUTBOX: Replay of {len(batch)} entr(y/ies) for spreadsheet '{spreadsheet_id}' failed (attempt {attempts}), will retry: {error_content}")
+        elif len(batch) > 1:
+            conn.execute(f"UPDATE outbox SET status = 'pending', owner = NULL, lease_expires_at = NULL WHERE {ids_clause}", entry_ids + [_outbox_owner])
+            _outbox_isolate_head.add(spreadsheet_id)
+            logger.warning(f"OUTBOX: Merged replay for spreadsheet '{spreadsheet_id}' was rejected; replaying entries one at a time: {error_content}")
+        else:
+            conn.execute(f"UPDATE outbox SET status = 'failed', owner = NULL, lease_expires_at = NULL, attempts = attempts + 1, last_error = ? WHERE {ids_clause}",
+                         [error_content] + entry_ids + [_outbox_owner])
+            _outbox_isolate_head.discard(spreadsheet_id)
+            logger.error(f"OUTBOX: Entry {entry_ids[0]} for spreadsheet '{spreadsheet_id}' was rejected and moved to 'failed': {error_content}")
+        return
+    conn.execute(f"DELETE FROM outbox WHERE {ids_clause}", entry_ids + [_outbox_owner])
+    if len(batch) == 1: _outbox_isolate_head.discard(spreadsheet_id)
+    completed_at = time.time()
+    with _outbox_metrics_lock:
+        _outbox_replayed.append((completed_at, len(batch)))
+        _outbox_replay_lag_seconds.extend(completed_at - row[4] for row in batch)
+    logger.info(f"OUTBOX: Replayed {len(batch)} {kind} entr(y/ies) for spreadsheet '{spreadsheet_id}' in {completed_at - start_time:.2f}s.")
+
+def _outbox_drain_done(spreadsheet_id, future):
+    with _outbox_draining_lock:
+        _outbox_draining.discard(spreadsheet_id)
+    if future.exception() is not None:
+        logger.error(f"OUTBOX: Drain of spreadsheet '{spreadsheet_id}' failed: {str(future.exception())}")
+    _outbox_wakeup.set() # The spreadsheet may have more entries queued behind the batch just replayed
+
+def _outbox_drain_loop():
+    logger.info(f"OUTBOX: Drainer {_outbox_owner} started on journal '{OUTBOX_DB_PATH}'.")
+    conn = _outbox_connection()
+    executor = ThreadPoolExecutor(max_workers=OUTBOX_DRAIN_CONCURRENCY, thread_name_prefix="outbox-drain")
+    while True:
+        _outbox_wakeup.clear()
+        try:
+            # Head of each spreadsheet's queue: when it is due (backoff) or when its lease runs out.
+            heads = conn.execute(
+                "SELECT spreadsheet_id, CASE WHEN status = 'in_flight' THEN lease_expires_at ELSE next_attempt_at END FROM outbox "
+                "WHERE id IN (SELECT MIN(id) FROM outbox WHERE status IN ('pending', 'in_flight') GROUP BY spreadsheet_id)"
+            ).fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"OUTBOX: Could not read journal: {str(e)}")
+            heads = []
+        now = time.time()
+        next_wakeup = now + OUTBOX_IDLE_POLL_SECONDS
+        for spreadsheet_id, due_at in heads:
+            if due_at is not None and due_at > now:
+                next_wakeup = min(next_wakeup, due_at); continue
+            with _outbox_draining_lock:
+                if spreadsheet_id in _outbox_draining: continue
+                _outbox_draining.add(spreadsheet_id)
+            # Spreadsheets are submitted independently: a slow one only occupies its own worker.
+            future = executor.submit(_outbox_drain_spreadsheet, spreadsheet_id)
+            future.add_done_callback(lambda f, sid=spreadsheet_id: _outbox_drain_done(sid, f))
+        _outbox_wakeup.wait(timeout=max(0.05, next_wakeup - time.time()))
+
+def _outbox_ensure_drainer():
+    global _outbox_thread
+    if _outbox_thread is not None and _outbox_thread.is_alive(): return
+    with _outbox_init_lock:
+        if _outbox_thread is None or not _outbox_thread.is_alive():
+            _outbox_thread = threading.Thread(target=_outbox_drain_loop, name="outbox-drainer", daemon=True)
+            _outbox_thread.start()
+
+def outbox_metrics_snapshot():
+    conn = _outbox_connection()
+    counts = dict(conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall())
+    oldest_pending = conn.execute("SELECT MIN(created_at) FROM outbox WHERE status IN ('pending', 'in_flight')").fetchone()[0]
+    now = time.time()
+    in_backoff = conn.execute("SELECT COUNT(DISTINCT spreadsheet_id) FROM outbox WHERE status = 'pending' AND next_attempt_at > ?", (now,)).fetchone()[0]
+    with _outbox_metrics_lock:
+        while _outbox_replayed and _outbox_replayed[0][0] < now - OUTBOX_RATE_WINDOW_SECONDS: _outbox_replayed.popleft()
+        replayed_in_window = sum(count for _, count in _outbox_replayed)
+        lags = sorted(_outbox_replay_lag_seconds)
+    journal_bytes = sum(os.path.getsize(path) for path in (OUTBOX_DB_PATH, OUTBOX_DB_PATH + "-wal") if os.path.exists(path))
+    return {
+        "journal": {"pending_entries": counts.get("pending", 0), "in_flight_entries": counts.get("in_flight", 0), "failed_entries": counts.get("failed", 0), "bytes": journal_bytes},
+        "drain_rate_entries_per_second": round(replayed_in_window / OUTBOX_RATE_WINDOW_SECONDS, 3), # This process's drainer only
+        "replay_lag_seconds": {
+            "oldest_pending": round(now - oldest_pending, 2) if oldest_pending else 0,
+            "p50": round(lags[len(lags) // 2], 2) if lags else None,
+            "p95": round(lags[min(len(lags) - 1, int(len(lags) * 0.95))], 2) if lags else None
+        },
+        "spreadsheets_in_backoff": in_backoff
+    }
+
+def handle_durable_write_request(endpoint_name, kind, required_fields_body):
+    logger.info(f"ENDPOINT {endpoint_name}: Durable write request received.")
+    start_time_total = time.time()
+    if not OUTBOX_ENABLED:
+        return jsonify({"success": False, "error": "ValueError", "details": "Durable mode is not enabled on this server (OUTBOX_ENABLED)."}), 400
+    data = request.get_json(silent=True)
+    all_required_fields = list(set(required_fields_body + ['refresh_token']))
+    if not data or not all(k in data for k in all_required_fields):
+        missing = [k for k in all_required_fields if not data or k not in data]
+        logger.warning(f"ENDPOINT {endpoint_name}: Missing required fields. Needs: {all_required_fields}. Missing: {missing}.")
+        return jsonify({"success": False, "error": f"Missing one or more required fields: {', '.join(missing)}"}), 400
+    list_field = "values_data" if kind == "append" else "requests_list"
+    if not isinstance(data[list_field], list) or not data[list_field]:
+        return jsonify({"success": False, "error": "ValueError", "details": f"{list_field} must be a non-empty list."}), 400
+    if kind == "batchUpdate" and 'max_payload_bytes' in data:
+        # Durable batchUpdates are replayed as single atomic calls; splitting would make retries re-apply earlier parts.
+        return jsonify({"success": False, "error": "ValueError", "details": "max_payload_bytes is not supported for durable writes."}), 400
+    payload = {k: v for k, v in data.items() if k not in ('refresh_token', 'durable', 'spreadsheet_id')}
+    try:
+        journal_id = outbox_enqueue(data['spreadsheet_id'], kind, payload, data['refresh_token'])
+    except sqlite3.Error as e:
+        logger.critical(f"ENDPOINT {endpoint_name}: Could not journal durable write: {str(e)}", exc_info=True)
+        return jsonify({"success": False, "error": "Journal write failed", "details": str(e)}), 503
+    logger.info(f"ENDPOINT {endpoint_name}: Journaled as entry {journal_id} (Total time: {time.time() - start_time_total:.3f}s).")
+    return jsonify({"success": True, "message": "Write journaled; it will be applied in order.", "details": {"journal_id": journal_id}}), 202
+
+@app.route('/sheets/outbox/entry/<int:journal_id>', methods=['GET'])
+def sheets_outbox_entry(journal_id):
+    if not OUTBOX_ENABLED:
+        return jsonify({"success": False, "error": "Durable mode is not enabled on this server."}), 404
+    row = _outbox_connection().execute("SELECT status, attempts, created_at, last_error FROM outbox WHERE id = ?", (journal_id,)).fetchone()
+    if row is None: # Replayed entries are removed from the journal
+        max_id = _outbox_connection().execute("SELECT seq FROM sqlite_sequence WHERE name = 'outbox'").fetchone()
+        if max_id and journal_id <= max_id[0]:
+            return jsonify({"success": True, "details": {"journal_id": journal_id, "status": "applied"}})
+        return jsonify({"success": False, "error": "Unknown journal_id"}), 404
+    return jsonify({"success": True, "details": {"journal_id": journal_id, "status": row[0], "attempts": row[1], "created_at": row[2], "last_error": row[3]}})
+
+@app.route('/metrics/outbox', methods=['GET'])
+def outbox_metrics():
+    if not OUTBOX_ENABLED:
+        return jsonify({"success": True, "details": {"enabled": False}})
+    return jsonify({"success": True, "details": dict(outbox_metrics_snapshot(), enabled=True)})
+
+if OUTBOX_ENABLED:
+    # Replay whatever a previous process journaled but did not get to apply.
+    if os.path.exists(OUTBOX_DB_PATH): _outbox_ensure_drainer()
 
 
 if __name__ == '__main__':
+    if "--build-startup-artifact" in sys.argv[1:]:
+        write_startup_artifact()
+        sys.exit(0)
     port = int(os.environ.get('PORT', 5000))
     logger.info(f"Starting Flask app on port {port}. Main Client ID: {CLIENT_ID[:10]}..., Specific Client ID: {SPECIFIC_CLIENT_ID[:10]}...")
     # For production, use a WSGI server like Gunicorn: gunicorn -w 4 -b 0.0.0.0:{port} script_name:app
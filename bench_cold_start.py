@@ -0,0 +1,64 @@
+"""
+Cold-start benchmark for GSheetsAPI.
+
+Each sample runs in a fresh interpreter and measures:
+  - import_ms: time to import the app module (Flask app + route registration)
+  - first_response_ms: time for the first request through the routing/validation path
+    (POST /sheets/op/repeatCell with an empty body, which returns 400 without network access)
+  - first_service_ms: time to build the first Sheets service object (pays the deferred
+    Google client imports and discovery document load)
+
+Usage: python bench_cold_start.py [--runs N]
+Compares the default mode with FAST_COLD_START=1 (building the startup artifact first).
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+CHILD_SCRIPT = r'''
+import json, logging, time
+t0 = time.perf_counter()
+import GSheetsAPI
+t1 = time.perf_counter()
+logging.disable(logging.CRITICAL)
+response = GSheetsAPI.app.test_client().post("/sheets/op/repeatCell", json={})
+t2 = time.perf_counter()
+GSheetsAPI.get_sheets_service("benchmark-token")
+t3 = time.perf_counter()
+print(json.dumps({
+    "import_ms": (t1 - t0) * 1000, "first_response_ms": (t2 - t1) * 1000,
+    "first_service_ms": (t3 - t2) * 1000, "status": response.status_code
+}))
+'''
+
+def run_sample(env):
+    completed = subprocess.run(
+        [sys.executable, "-c", CHILD_SCRIPT], cwd=APP_DIR, env=env,
+        capture_output=True, text=True, check=True
+    )
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+def run_mode(label, env, runs):
+    samples = [run_sample(env) for _ in range(runs)]
+    summary = {key: round(statistics.median(s[key] for s in samples), 1) for key in ("import_ms", "first_response_ms", "first_service_ms")}
+    print(f"{label:<16} import {summary['import_ms']:>7.1f} ms | first response {summary['first_response_ms']:>6.1f} ms | first service build {summary['first_service_ms']:>7.1f} ms (median of {runs})")
+    return summary
+
+def main():
+    runs = int(sys.argv[sys.argv.index("--runs") + 1]) if "--runs" in sys.argv else 5
+    base_env = dict(os.environ)
+    base_env.pop("FAST_COLD_START", None)
+    run_mode("default", base_env, runs)
+
+    with tempfile.TemporaryDirectory() as artifact_dir:
+        fast_env = dict(base_env, FAST_COLD_START="1", STARTUP_ARTIFACT_DIR=artifact_dir)
+        subprocess.run([sys.executable, "GSheetsAPI.py", "--build-startup-artifact"], cwd=APP_DIR, env=fast_env, capture_output=True, check=True)
+        run_mode("FAST_COLD_START", fast_env, runs)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+import threading
+import time
+from collections import deque
+
+import pytest
+
+import GSheetsAPI
+from GSheetsAPI import admission_acquire, admission_release
+
+READ, WRITE = "sheets_get_values", "sheets_batch_update_requests"
+
+@pytest.fixture(autouse=True)
+def fresh_admission_state(monkeypatch):
+    monkeypatch.setattr(GSheetsAPI, "_admission_waiters", [])
+    monkeypatch.setattr(GSheetsAPI, "_admission_in_flight", {"total": 0, "tenant": {}, "endpoint": {}, "priority": {}})
+    monkeypatch.setattr(GSheetsAPI, "_admission_hold_seconds_ewma", {})
+    monkeypatch.setattr(GSheetsAPI, "_admission_metrics", {p: {"admitted": 0, "shed": 0, "wait_seconds": deque()} for p in GSheetsAPI.ADMISSION_PRIORITIES})
+    monkeypatch.setattr(GSheetsAPI, "ADMISSION_WORKER_THREADS", 8)
+    monkeypatch.setattr(GSheetsAPI, "ADMISSION_RESERVED_INTERACTIVE_THREADS", 2)
+    monkeypatch.setattr(GSheetsAPI, "ADMISSION_MAX_CONCURRENT_PER_TENANT", 4)
+
+def wait_for_waiters(count, timeout=2.0):
+    deadline = time.time() + timeout
+    while len(GSheetsAPI._admission_waiters) != count:
+        assert time.time() < deadline, "waiter did not queue in time"
+        time.sleep(0.01)
+
+def test_tenant_at_its_cap_is_shed_with_429_and_retry_after(monkeypatch):
+    monkeypatch.setattr(GSheetsAPI, "ADMISSION_CONTROL_ENABLED", True)
+    monkeypatch.setattr(GSheetsAPI, "ADMISSION_QUEUE_DEADLINE_SECONDS", {"interactive": 0.05, "bulk": 0.05})
+    monkeypatch.setattr(GSheetsAPI, "get_access_token", lambda refresh_token: pytest.fail("shed request reached Google"))
+    tenant_key = GSheetsAPI._refresh_token_hash("busy-token")
+    for _ in range(GSheetsAPI.ADMISSION_MAX_CONCURRENT_PER_TENANT):
+        assert admission_acquire(tenant_key, READ, "interactive") is not None
+    GSheetsAPI._admission_hold_seconds_ewma[READ] = 2.4
+
+    response = GSheetsAPI.app.test_client().post("/sheets/values/get", json={
+        "spreadsheet_id": "s", "range_name": "A1", "refresh_token": "busy-token"
+    })
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "3"
+    assert GSheetsAPI._admission_waiters == []
+    assert GSheetsAPI._admission_in_flight["tenant"][tenant_key] == GSheetsAPI.ADMISSION_MAX_CONCURRENT_PER_TENANT
+
+def test_interactive_read_is_admitted_while_bulk_fills_unreserved_threads():
+    bulk_threads = GSheetsAPI.ADMISSION_WORKER_THREADS - GSheetsAPI.ADMISSION_RESERVED_INTERACTIVE_THREADS
+    for i in range(bulk_threads):
+        assert admission_acquire(f"bulk-tenant-{i % 2}", WRITE, "bulk") is not None
+
+    # More bulk work is shed at once rather than queueing for the reserved threads.
+    start_time = time.time()
+    assert admission_acquire("bulk-tenant-2", WRITE, "bulk") is None
+    assert time.time() - start_time < 0.5
+    assert admission_acquire("reader", READ, "interactive") is not None
+    assert GSheetsAPI._admission_in_flight["priority"] == {"bulk": bulk_threads, "interactive": 1}
+
+def test_waiter_whose_tenant_is_at_its_cap_does_not_block_others():
+    for _ in range(GSheetsAPI.ADMISSION_MAX_CONCURRENT_PER_TENANT):
+        admission_acquire("busy", READ, "interactive")
+    blocked_result = []
+    blocked = threading.Thread(target=lambda: blocked_result.append(admission_acquire("busy", READ, "interactive")))
+    blocked.start()
+    wait_for_waiters(1)
+
+    # Queued behind the blocked waiter, but its own tenant has room.
+    assert admission_acquire("other", READ, "interactive") is not None
+    assert [w[2] for w in GSheetsAPI._admission_waiters] == ["busy"]
+
+    admission_release("busy", READ, "interactive", 0.01)
+    blocked.join(timeout=2.0)
+    assert blocked_result and blocked_result[0] is not None
+    assert GSheetsAPI._admission_waiters == []
@@ -0,0 +1,105 @@
+import pytest
+
+import GSheetsAPI
+from GSheetsAPI import optimize_batch_update_requests
+
+RED = {"userEnteredFormat": {"backgroundColor": {"red": 1}}}
+BLUE = {"userEnteredFormat": {"backgroundColor": {"blue": 1}}}
+SOLID = {"style": "SOLID"}
+
+def cell_range(row_start, row_end, col_start, col_end, sheet_id=0):
+    return {"sheetId": sheet_id, "startRowIndex": row_start, "endRowIndex": row_end, "startColumnIndex": col_start, "endColumnIndex": col_end}
+
+def repeat_cell(range_dict, cell, fields="userEnteredFormat.backgroundColor"):
+    return {"repeatCell": {"range": range_dict, "cell": cell, "fields": fields}}
+
+def borders(range_dict, **sides):
+    return {"updateBorders": dict({"range": range_dict}, **sides)}
+
+def optimized(requests_list, **kwargs):
+    batches, report = optimize_batch_update_requests(requests_list, **kwargs)
+    return [req for batch in batches for req in batch], report
+
+def test_adjacent_compatible_cells_are_merged():
+    result, report = optimized([repeat_cell(cell_range(0, 1, col, col + 1), RED) for col in range(5)])
+    assert result == [repeat_cell(cell_range(0, 1, 0, 5), RED)]
+    assert report["merged"] == 4
+
+def test_no_merge_across_intersecting_op():
+    requests_list = [
+        repeat_cell(cell_range(0, 1, 0, 1), RED),
+        borders(cell_range(0, 1, 0, 2), top=SOLID),
+        repeat_cell(cell_range(0, 1, 1, 2), RED),
+    ]
+    result, report = optimized(requests_list)
+    assert result == requests_list
+    assert report["merged"] == 0
+
+def test_merge_across_non_intersecting_op():
+    requests_list = [
+        repeat_cell(cell_range(0, 1, 0, 1), RED),
+        repeat_cell(cell_range(5, 6, 0, 1), BLUE),
+        repeat_cell(cell_range(0, 1, 1, 2), RED),
+    ]
+    result, _ = optimized(requests_list)
+    assert result == [repeat_cell(cell_range(0, 1, 0, 2), RED), repeat_cell(cell_range(5, 6, 0, 1), BLUE)]
+
+def test_override_across_update_borders():
+    requests_list = [
+        repeat_cell(cell_range(0, 2, 0, 2), RED),
+        borders(cell_range(0, 2, 0, 2), top=SOLID),
+        repeat_cell(cell_range(0, 3, 0, 3), BLUE),
+    ]
+    result, report = optimized(requests_list)
+    assert result == requests_list[1:]
+    assert report["removed_overridden"] == 1
+
+def test_narrower_fields_do_not_override():
+    requests_list = [
+        repeat_cell(cell_range(0, 1, 0, 1), RED, fields="userEnteredFormat"),
+        repeat_cell(cell_range(0, 1, 0, 1), BLUE, fields="userEnteredFormat.backgroundColor"),
+    ]
+    result, _ = optimized(requests_list)
+    assert result == requests_list
+
+def test_barrier_is_kept_in_place_and_blocks_merging():
+    barrier = {"insertDimension": {"range": {"sheetId": 0, "dimension": "ROWS", "startIndex": 0, "endIndex": 1}}}
+    requests_list = [
+        repeat_cell(cell_range(0, 1, 0, 1), RED),
+        barrier,
+        repeat_cell(cell_range(0, 1, 1, 2), RED),
+        repeat_cell(cell_range(0, 1, 0, 1), BLUE),
+        barrier,
+        repeat_cell(cell_range(0, 1, 0, 1), BLUE),
+    ]
+    result, report = optimized(requests_list)
+    assert result == requests_list
+    assert report["merged"] == 0 and report["removed_overridden"] == 0
+
+def test_batches_split_under_payload_limit():
+    requests_list = [repeat_cell(cell_range(row, row + 1, 0, 1), RED if row % 2 else BLUE) for row in range(50)]
+    batches, report = optimize_batch_update_requests(requests_list, max_payload_bytes=1000)
+    assert [req for batch in batches for req in batch] == requests_list
+    assert len(batches) == report["batches"] > 1
+    for batch in batches:
+        assert len(GSheetsAPI.json.dumps({"requests": batch}, separators=(',', ':'))) <= 1000
+
+def test_oversized_single_request_is_sent_alone():
+    big = repeat_cell(cell_range(0, 1, 0, 1), {"userEnteredValue": {"stringValue": "x" * 500}}, fields="userEnteredValue")
+    first, last = repeat_cell(cell_range(5, 6, 0, 1), RED), repeat_cell(cell_range(7, 8, 0, 1), RED)
+    batches, _ = optimize_batch_update_requests([first, big, last], max_payload_bytes=300)
+    assert batches == [[first], [big], [last]]
+
+@pytest.mark.parametrize("max_payload_bytes", ["1000", 0, -5, 1.5, True, None])
+def test_invalid_max_payload_bytes_is_rejected(max_payload_bytes):
+    with pytest.raises(ValueError):
+        optimize_batch_update_requests([repeat_cell(cell_range(0, 1, 0, 1), RED)], max_payload_bytes=max_payload_bytes)
+
+def test_invalid_max_payload_bytes_returns_400(monkeypatch):
+    monkeypatch.setattr(GSheetsAPI, "get_access_token", lambda refresh_token: "access-token")
+    monkeypatch.setattr(GSheetsAPI, "get_sheets_service", lambda access_token: object())
+    response = GSheetsAPI.app.test_client().post("/sheets/batchUpdate", json={
+        "spreadsheet_id": "s", "refresh_token": "t", "optimize": True, "max_payload_bytes": "big",
+        "requests_list": [repeat_cell(cell_range(0, 1, 0, 1), RED)]
+    })
+    assert response.status_code == 400
@@ -0,0 +1,53 @@
+import json
+
+import GSheetsAPI
+from GSheetsAPI import build_compact_update_cells_requests
+
+TEMPLATES = [{"textFormat": {"bold": True}}, {"textFormat": {"italic": True}}]
+
+def test_cells_without_template_keep_their_format(monkeypatch):
+    # More values than templates in the row: the expanded form would clear the third cell's format.
+    monkeypatch.setattr(GSheetsAPI, "COMPACT_MAX_REPEAT_CELL_REGIONS", 0)
+    requests_list, strategy = build_compact_update_cells_requests(0, [[1, 2, 3]], TEMPLATES, [[0, 1]])
+    assert strategy == "repeatCell_regions"
+    assert requests_list[-1]["updateCells"]["fields"] == "userEnteredValue"
+
+def test_fragmented_formats_use_expanded_form_when_every_cell_has_a_template(monkeypatch):
+    monkeypatch.setattr(GSheetsAPI, "COMPACT_MAX_REPEAT_CELL_REGIONS", 0)
+    requests_list, strategy = build_compact_update_cells_requests(0, [[1, 2]], TEMPLATES, [[0, 1]])
+    assert strategy == "expanded"
+    assert requests_list == [{"updateCells": {
+        "rows": [{"values": [
+            {"userEnteredValue": {"numberValue": 1}, "userEnteredFormat": TEMPLATES[0]},
+            {"userEnteredValue": {"numberValue": 2}, "userEnteredFormat": TEMPLATES[1]}
+        ]}],
+        "fields": "userEnteredValue,userEnteredFormat",
+        "start": {"sheetId": 0, "rowIndex": 0, "columnIndex": 0}
+    }}]
+
+def test_large_expanded_body_is_split_by_rows(monkeypatch):
+    monkeypatch.setattr(GSheetsAPI, "BATCH_UPDATE_MAX_PAYLOAD_BYTES", 20000)
+    values = [[row * 10 + col for col in range(10)] for row in range(100)]
+    checkerboard = [[(row + col) % 2 for col in range(10)] for row in range(100)]
+    requests_list, strategy = build_compact_update_cells_requests(0, values, TEMPLATES, checkerboard, start_row_index=5)
+    assert strategy == "expanded" and len(requests_list) > 1
+    assert all(len(json.dumps(req)) < 20000 for req in requests_list)
+    row_starts = [req["updateCells"]["start"]["rowIndex"] for req in requests_list]
+    row_counts = [len(req["updateCells"]["rows"]) for req in requests_list]
+    assert row_starts[0] == 5 and sum(row_counts) == 100
+    assert all(start + count == next_start for start, count, next_start in zip(row_starts, row_counts, row_starts[1:]))
+
+def test_one_untemplated_cell_only_keeps_its_own_row_out_of_the_expanded_form(monkeypatch):
+    monkeypatch.setattr(GSheetsAPI, "COMPACT_MAX_REPEAT_CELL_REGIONS", 10)
+    values = [[row * 4 + col for col in range(4)] for row in range(20)]
+    checkerboard = [[(row + col) % 2 for col in range(4)] for row in range(20)]
+    checkerboard[3][1] = None
+    requests_list, strategy = build_compact_update_cells_requests(0, values, TEMPLATES, checkerboard)
+    assert strategy == "mixed"
+    expanded = [req["updateCells"] for req in requests_list if "updateCells" in req and req["updateCells"]["fields"] == "userEnteredValue,userEnteredFormat"]
+    assert [(req["start"]["rowIndex"], len(req["rows"])) for req in expanded] == [(0, 3), (4, 16)]
+    region_ranges = [req["repeatCell"]["range"] for req in requests_list if "repeatCell" in req]
+    assert region_ranges and all(r["startRowIndex"] == 3 and r["endRowIndex"] == 4 for r in region_ranges)
+    assert sorted(r["startColumnIndex"] for r in region_ranges) == [0, 2, 3]
+    values_only = [req["updateCells"] for req in requests_list if "updateCells" in req and req["updateCells"]["fields"] == "userEnteredValue"]
+    assert [(req["start"]["rowIndex"], len(req["rows"])) for req in values_only] == [(3, 1)]
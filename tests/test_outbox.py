@@ -0,0 +1,122 @@
+import threading
+import time
+
+import httplib2
+import pytest
+
+import GSheetsAPI
+
+class StubSheets:
+    """Records replayed calls; fail_with(status) makes the next call raise that HttpError."""
+    def __init__(self):
+        self.calls, self.failures, self.during_call = [], [], None
+
+    def fail_with(self, status):
+        self.failures.append(status)
+
+    def _call(self, record):
+        if self.during_call is not None: self.during_call()
+        if self.failures:
+            status = self.failures.pop(0)
+            raise GSheetsAPI.HttpError(httplib2.Response({"status": status}), b"stub error")
+        self.calls.append(record)
+        return {}
+
+    def append(self, service, spreadsheet_id, range_name, values_data, value_input_option="USER_ENTERED", insert_data_option="INSERT_ROWS"):
+        return self._call(("append", spreadsheet_id, range_name, values_data))
+
+    def batch_update(self, service, spreadsheet_id, requests_list):
+        if any(req.get("bad") for req in requests_list):
+            raise GSheetsAPI.HttpError(httplib2.Response({"status": 400}), b"invalid request")
+        return self._call(("batchUpdate", spreadsheet_id, requests_list))
+
+@pytest.fixture
+def stub(tmp_path, monkeypatch):
+    GSheetsAPI._load_google_client_libs()
+    monkeypatch.setattr(GSheetsAPI, "OUTBOX_DB_PATH", str(tmp_path / "outbox.sqlite3"))
+    monkeypatch.setattr(GSheetsAPI, "_outbox_initialized", False)
+    monkeypatch.setattr(GSheetsAPI, "_outbox_local", threading.local())
+    monkeypatch.setattr(GSheetsAPI, "_outbox_isolate_head", set())
+    monkeypatch.setattr(GSheetsAPI, "_outbox_access_tokens", {})
+    monkeypatch.setattr(GSheetsAPI, "_outbox_ensure_drainer", lambda: None)
+    monkeypatch.setattr(GSheetsAPI, "get_access_token", lambda refresh_token: "access-token")
+    monkeypatch.setattr(GSheetsAPI, "get_sheets_service", lambda access_token: object())
+    sheets = StubSheets()
+    monkeypatch.setattr(GSheetsAPI, "api_append_values", sheets.append)
+    monkeypatch.setattr(GSheetsAPI, "api_batch_update", sheets.batch_update)
+    return sheets
+
+def journal():
+    return GSheetsAPI._outbox_connection().execute("SELECT id, status, attempts, owner, next_attempt_at FROM outbox ORDER BY id").fetchall()
+
+def enqueue_append(values, range_name="A1", refresh_token="rt", spreadsheet_id="S"):
+    return GSheetsAPI.outbox_enqueue(spreadsheet_id, "append", {"range_name": range_name, "values_data": values}, refresh_token)
+
+def enqueue_batch_update(requests_list, refresh_token="rt", spreadsheet_id="S", **options):
+    return GSheetsAPI.outbox_enqueue(spreadsheet_id, "batchUpdate", dict(options, requests_list=requests_list), refresh_token)
+
+def drain_until_idle(spreadsheet_id="S", rounds=10):
+    for _ in range(rounds):
+        GSheetsAPI._outbox_drain_spreadsheet(spreadsheet_id)
+
+def test_server_error_is_retried_after_backoff_then_merged_in_order(stub):
+    for row in range(3): enqueue_append([[row]])
+    stub.fail_with(503)
+    GSheetsAPI._outbox_drain_spreadsheet("S")
+    entries = journal()
+    assert [(status, attempts, owner) for _, status, attempts, owner, _ in entries] == [("pending", 1, None)] * 3
+    assert entries[0][4] > time.time()
+
+    GSheetsAPI._outbox_drain_spreadsheet("S") # Still backing off
+    assert stub.calls == []
+
+    GSheetsAPI._outbox_connection().execute("UPDATE outbox SET next_attempt_at = 0")
+    GSheetsAPI._outbox_drain_spreadsheet("S")
+    assert stub.calls == [("append", "S", "A1", [[0], [1], [2]])]
+    assert journal() == []
+
+def test_rejected_entry_is_isolated_from_merged_batch(stub):
+    enqueue_batch_update([{"a": 1}])
+    bad_id = enqueue_batch_update([{"bad": True}])
+    enqueue_batch_update([{"c": 3}])
+    drain_until_idle()
+    assert stub.calls == [("batchUpdate", "S", [{"a": 1}]), ("batchUpdate", "S", [{"c": 3}])]
+    assert [(entry_id, status) for entry_id, status, *_ in journal()] == [(bad_id, "failed")]
+
+def test_live_lease_blocks_and_expired_lease_is_taken_over(stub):
+    enqueue_append([[1]])
+    conn = GSheetsAPI._outbox_connection()
+    conn.execute("UPDATE outbox SET status = 'in_flight', owner = 'other-process', lease_expires_at = ?", (time.time() + 60,))
+    GSheetsAPI._outbox_drain_spreadsheet("S")
+    assert stub.calls == [] and journal()[0][3] == "other-process"
+
+    conn.execute("UPDATE outbox SET lease_expires_at = ?", (time.time() - 1,))
+    GSheetsAPI._outbox_drain_spreadsheet("S")
+    assert stub.calls == [("append", "S", "A1", [[1]])]
+    assert journal() == []
+
+def test_lost_lease_does_not_touch_new_owners_rows(stub):
+    enqueue_append([[1]])
+    # Another drainer takes the entry over while this one is still calling Google.
+    stub.during_call = lambda: GSheetsAPI._outbox_connection().execute("UPDATE outbox SET owner = 'other-process'")
+    GSheetsAPI._outbox_drain_spreadsheet("S")
+    assert len(stub.calls) == 1
+    assert [(status, owner) for _, status, _, owner, _ in journal()] == [("in_flight", "other-process")]
+
+@pytest.mark.parametrize("second_entry", [
+    {"range_name": "B1"},
+    {"refresh_token": "other-token"},
+])
+def test_appends_merge_only_with_same_range_and_token(stub, second_entry):
+    enqueue_append([[1]])
+    enqueue_append([[2]], **second_entry)
+    enqueue_append([[3]], **second_entry)
+    drain_until_idle()
+    assert [call[3] for call in stub.calls] == [[[1]], [[2], [3]]]
+
+def test_batch_updates_merge_only_with_same_optimize_setting(stub):
+    enqueue_batch_update([{"a": 1}])
+    enqueue_batch_update([{"b": 2}])
+    enqueue_batch_update([{"c": 3}], optimize=True)
+    drain_until_idle()
+    assert [call[2] for call in stub.calls] == [[{"a": 1}, {"b": 2}], [{"c": 3}]]